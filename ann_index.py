@@ -0,0 +1,157 @@
+import os
+import math
+import numpy as np
+import faiss
+from termcolor import colored
+
+# FAISS index types of the local VDB (see docs/KnowledgeBase.md); stores switch from Flat once they are large enough
+INDEX_TYPES = ("Flat", "IVFFlat", "IVFPQ", "IVFSQ8", "HNSW", "HNSWSQ8", "SQ8")
+index_type = os.environ.get("VDB_INDEX_TYPE", "Flat")
+min_ann_vectors = int(os.environ.get("VDB_ANN_MIN_VECTORS", 50000))
+train_sample = int(os.environ.get("VDB_TRAIN_SAMPLE", 100000))
+default_nprobe = int(os.environ.get("VDB_NPROBE", 16))
+default_ef_search = int(os.environ.get("VDB_EF_SEARCH", 64))
+hnsw_m = int(os.environ.get("VDB_HNSW_M", 32))
+# Product quantizer sub-vectors; 0 picks about dim / 8
+pq_m = int(os.environ.get("VDB_PQ_M", 0))
+
+
+def nlist_for(count):
+    # Rule of thumb: about 4 * sqrt(n) cells, with enough training points per cell
+    return int(max(1, min(65536, 4 * math.sqrt(count), count // 39)))
+
+
+def pq_subquantizers(dim):
+    if pq_m:
+        return pq_m
+    for m in range(max(1, dim // 8), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def pq_bits(count):
+    # k-means needs at least 2 ** nbits training points per sub-quantizer; 8 bits unless the store is tiny
+    return max(1, min(8, int(math.log2(max(count, 1)))))
+
+
+def factory_string(kind, dim, count):
+    if kind == "Flat":
+        return "Flat"
+    if kind == "IVFFlat":
+        return f"IVF{nlist_for(count)},Flat"
+    if kind == "IVFPQ":
+        nbits = pq_bits(min(count, train_sample))
+        if nbits < 8:
+            print(colored(f"Only {count} vectors to train the product quantizer, using {nbits}-bit codes", "yellow"))
+        return f"IVF{nlist_for(count)},PQ{pq_subquantizers(dim)}x{nbits}"
+    if kind == "IVFSQ8":
+        return f"IVF{nlist_for(count)},SQ8"
+    if kind == "HNSW":
+        return f"HNSW{hnsw_m},Flat"
+    if kind == "HNSWSQ8":
+        return f"HNSW{hnsw_m},SQ8"
+    if kind == "SQ8":
+        return "SQ8"
+    raise ValueError(f"Unknown VDB index type {kind}, expected one of {', '.join(INDEX_TYPES)}")
+
+
+def is_positional(index):
+    # Plain flat indexes are addressed by position and compact on removal
+    return isinstance(index, faiss.IndexFlat)
+
+
+def base_index(index):
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def apply_search_defaults(index):
+    # Defaults for callers that search without parameters, e.g. FAISS.similarity_search
+    base = base_index(index)
+    if isinstance(base, faiss.IndexIVF):
+        base.nprobe = default_nprobe
+    elif isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = default_ef_search
+    return index
+
+
+def search_parameters(index, nprobe=None, ef_search=None):
+    # Per-call knobs, so concurrent sessions do not change each other's settings
+    base = base_index(index)
+    if isinstance(base, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(nprobe=nprobe or default_nprobe)
+    if isinstance(base, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=ef_search or default_ef_search)
+    return None
+
+
+def build_index(vectors, labels, kind=index_type):
+    dim = vectors.shape[1]
+    index = faiss.index_factory(dim, factory_string(kind, dim, len(vectors)))
+    if not index.is_trained:
+        sample = vectors
+        if len(vectors) > train_sample:
+            rows = np.random.default_rng(0).choice(len(vectors), train_sample, replace=False)
+            sample = vectors[np.sort(rows)]
+        index.train(sample)
+    if not isinstance(index, faiss.IndexIVF):
+        # IVF indexes store labels natively; the others need an id map
+        index = faiss.IndexIDMap2(index)
+    index.add_with_ids(vectors, labels.astype(np.int64))
+    return apply_search_defaults(index)
+
+
+def labeled_vectors(index):
+    # All vectors with their labels, for flat and id-mapped indexes
+    if is_positional(index):
+        return index.reconstruct_n(0, index.ntotal), np.arange(index.ntotal, dtype=np.int64)
+    vectors = base_index(index).reconstruct_n(0, index.ntotal)
+    return vectors, faiss.vector_to_array(index.id_map)
+
+
+def maybe_upgrade(faiss_store, kind=index_type):
+    # Converts a large enough flat store to the configured index type; the mapping keys stay valid
+    index = faiss_store.index
+    if kind == "Flat" or not is_positional(index) or index.ntotal < min_ann_vectors:
+        return False
+    print(colored(f"Converting the VDB index to {kind} ({index.ntotal} vectors)...", "green"))
+    vectors, labels = labeled_vectors(index)
+    faiss_store.index = build_index(vectors, labels, kind)
+    return True
+
+
+def next_label(faiss_store):
+    return max(faiss_store.index_to_docstore_id, default=-1) + 1
+
+
+def add_vectors(index, vectors, labels):
+    index.add_with_ids(np.ascontiguousarray(vectors, dtype=np.float32), np.asarray(labels, dtype=np.int64))
+
+
+def remove_labels(index, labels):
+    labels = np.asarray(labels, dtype=np.int64)
+    try:
+        index.remove_ids(labels)
+    except RuntimeError:
+        # HNSW graphs do not support deletion; rebuild from the remaining vectors
+        vectors, current = labeled_vectors(index)
+        keep = ~np.isin(current, labels)
+        index.reset()
+        index.add_with_ids(vectors[keep], current[keep])
+
+
+def index_bytes(index):
+    # Approximate resident size of the vectors and index structures
+    base = base_index(index)
+    count = index.ntotal
+    extra = 16 * count if isinstance(index, faiss.IndexIDMap) else 0
+    if isinstance(base, faiss.IndexIVF):
+        return count * (base.code_size + 8) + base.nlist * base.d * 4 + extra
+    if isinstance(base, faiss.IndexHNSW):
+        storage = faiss.downcast_index(base.storage)
+        code_size = getattr(storage, "code_size", base.d * 4)
+        # Level 0 links dominate; upper levels hold about 1 / M of the vectors
+        return count * (code_size + base.hnsw.nb_neighbors(0) * 4) + extra
+    return count * getattr(base, "code_size", base.d * 4) + extra
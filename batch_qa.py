@@ -0,0 +1,237 @@
+import os
+import sys
+import json
+import time
+import argparse
+from collections import deque, Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from termcolor import colored
+from repo_parser import is_repo_folder, default_repo_folder, describe_repo, generate_or_load_knowledge_from_repo, \
+    generate_or_load_symbol_index, generate_or_load_call_graph
+import tool_planner
+import indexing_jobs
+import context_packer
+import metrics
+import llm_client
+from sse import iter_chat_deltas, StreamError
+from code_learner import init_system_prompt, model, code_repo_path, build_messages, chat_payload
+
+# Answers a JSON-lines file of questions without the GUI; reruns resume where they stopped
+batch_workers = int(os.environ.get("BATCH_WORKERS", 8))
+batch_per_repo = int(os.environ.get("BATCH_PER_REPO", 4))
+
+
+def read_questions(path, id_field="id", question_field="question", repo_field="repo", default_repo=None):
+    # One JSON object per line; the id defaults to the line number, the repo to default_repo.
+    # A line without a question is kept with an error, so it is reported as failed instead of stopping the batch.
+    questions = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                item = {"id": str(record.get(id_field, line_number)), "repo": record.get(repo_field) or default_repo}
+                item["question"] = record[question_field]
+            except (ValueError, AttributeError) as e:
+                item = {"id": str(line_number), "repo": default_repo, "question": None,
+                        "error": f"Invalid line {line_number}: {type(e).__name__}: {e}"}
+            except KeyError:
+                item.update(question=None, error=f"Line {line_number} has no {question_field!r} field")
+            questions.append(item)
+    return questions
+
+
+def read_answered(output_path):
+    # Ids with an answer in a previous run; failed questions are retried
+    answered = set()
+    if not os.path.isfile(output_path):
+        return answered
+    with open(output_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Last line of an interrupted write
+                continue
+            if record.get("error") is None:
+                answered.add(record["id"])
+            else:
+                answered.discard(record["id"])
+    return answered
+
+
+def prepare_repo(repo):
+    # Returns the folder to answer from and the repo information for the system prompt: a checkout is brought
+    # up to date in place, anything else is analyzed like a repo link in the GUI
+    if repo is None:
+        repo_folder = default_repo_folder(code_repo_path)
+        if repo_folder is None:
+            raise RuntimeError(f"No repo given, and {code_repo_path} does not hold exactly one checkout")
+        return repo_folder, describe_repo(repo_folder)
+    if is_repo_folder(repo):
+        with indexing_jobs.repo_lock(repo):
+            generate_or_load_symbol_index(repo)
+            generate_or_load_call_graph(repo)
+            generate_or_load_knowledge_from_repo(repo)
+        return repo, describe_repo(repo)
+    job = indexing_jobs.submit(repo, code_repo_path)
+    job.done.wait()
+    if job.state == "failed":
+        raise RuntimeError(job.error)
+    return job.repo_folder, job.repo_information
+
+
+def answer_question(question, repo_folder, system_msg=init_system_prompt, top_p=1.0, temperature=1.0):
+    # One question, no history: returns the answer, the packed contexts and the stage timings in ms
+    start = time.perf_counter()
+    with metrics.trace() as trace_id:
+        header, chunks = tool_planner.plan_context(question, repo_folder)
+        plan_end = time.perf_counter()
+        messages = build_messages(system_msg, 0, [])
+        inputs = context_packer.pack_prompt(messages, header, chunks, model)
+    messages.append({"role": "user", "content": inputs})
+    answer, ttft, error = [], None, None
+    stream_start = time.perf_counter()
+    response = llm_client.stream_chat_completion(chat_payload(messages, top_p, temperature))
+    try:
+        for delta in iter_chat_deltas(response):
+            if ttft is None and delta:
+                ttft = time.perf_counter() - stream_start
+                metrics.observe("ttft", ttft, trace=trace_id)
+            answer.append(delta)
+    except StreamError as e:
+        error = f"{type(e).__name__}: {e}"
+    finally:
+        response.close()
+    end = time.perf_counter()
+    answer = "".join(answer)
+    metrics.observe("stream", end - stream_start,
+                    {"chars": len(answer), "tokens": context_packer.count_tokens(answer, model)}, error, trace_id)
+    metrics.observe("question", end - start, None, error, trace_id)
+    return {
+        "answer": answer,
+        # The chunks that fit the prompt, in the order they were packed
+        "contexts": [chunk for chunk in chunks if chunk in inputs],
+        "error": error,
+        "trace": trace_id,
+        "timings": {
+            "plan_ms": (plan_end - start) * 1000,
+            "ttft_ms": ttft * 1000 if ttft is not None else None,
+            "stream_ms": (end - stream_start) * 1000,
+            "total_ms": (end - start) * 1000,
+        },
+    }
+
+
+def _answer(item, repo_folder, system_msg):
+    try:
+        result = answer_question(item["question"], repo_folder, system_msg)
+    except Exception as e:
+        result = {"answer": "", "contexts": [], "error": f"{type(e).__name__}: {e}", "timings": {}}
+    return dict(item, **result)
+
+
+def run_batch(questions, output_path, workers=batch_workers, per_repo=batch_per_repo, system_msg=init_system_prompt,
+              resume=True):
+    # Answers the questions and appends one JSON line per question to output_path; returns the counts
+    answered = read_answered(output_path) if resume else set()
+    pending, invalid = {}, []
+    for item in questions:
+        if item["id"] in answered:
+            continue
+        if item.get("error"):
+            invalid.append(item)
+        else:
+            pending.setdefault(item["repo"], deque()).append(item)
+    counts = Counter(skipped=len(questions) - len(invalid) - sum(len(items) for items in pending.values()))
+    if not pending and not invalid:
+        return counts
+
+    start = time.perf_counter()
+    preparer = ThreadPoolExecutor(max_workers=max(1, indexing_jobs.index_job_workers))
+    executor = ThreadPoolExecutor(max_workers=workers)
+    prepared = {repo: preparer.submit(prepare_repo, repo) for repo in pending}
+    in_flight = {}  # future -> repo
+    running = Counter()
+    with open(output_path, "a" if resume else "w") as out:
+        if out.tell():
+            # Drop the partial last line of an interrupted write
+            with open(output_path, "rb+") as f:
+                data = f.read()
+                f.truncate(data.rfind(b"\n") + 1)
+            out.seek(0, os.SEEK_END)
+
+        def write(record):
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            counts["failed" if record.get("error") else "answered"] += 1
+
+        for item in invalid:
+            write(dict(item, answer="", contexts=[], timings={}))
+        try:
+            while pending or in_flight:
+                # Fill free workers from the repos that are ready, at most per_repo questions each
+                for repo in list(pending):
+                    if not prepared[repo].done():
+                        continue
+                    try:
+                        repo_folder, repo_information = prepared[repo].result()
+                    except Exception as e:
+                        print(colored(f"Failed to analyze {repo}: {e}", "red"))
+                        for item in pending.pop(repo):
+                            write(dict(item, answer="", contexts=[], error=f"Analysis failed: {e}", timings={}))
+                        continue
+                    items = pending[repo]
+                    while items and running[repo] < per_repo and len(in_flight) < workers:
+                        in_flight[executor.submit(_answer, items.popleft(), repo_folder,
+                                                  system_msg + (repo_information or ""))] = repo
+                        running[repo] += 1
+                    if not items:
+                        del pending[repo]
+                waiting = list(in_flight) + [prepared[repo] for repo in pending if not prepared[repo].done()]
+                done, _ = wait(waiting, return_when=FIRST_COMPLETED)
+                for future in done:
+                    repo = in_flight.pop(future, None)
+                    if repo is None:
+                        continue
+                    running[repo] -= 1
+                    record = future.result()
+                    write(record)
+                    print(colored(f"[{counts['answered'] + counts['failed']}] {record['id']}: "
+                                  f"{record['error'] or 'answered'}", "red" if record["error"] else "green"),
+                          file=sys.stderr)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            preparer.shutdown(wait=False, cancel_futures=True)
+    counts["seconds"] = time.perf_counter() - start
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a JSON-lines file of questions about code repos")
+    parser.add_argument("questions", help="JSON lines with an id, a question and optionally a repo")
+    parser.add_argument("output", help="JSON lines with the answers, appended to and resumed from")
+    parser.add_argument("--repo", help="Repo URL or checkout folder for questions without one")
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--question-field", default="question")
+    parser.add_argument("--repo-field", default="repo")
+    parser.add_argument("--workers", type=int, default=batch_workers, help="Questions in flight overall")
+    parser.add_argument("--per-repo", type=int, default=batch_per_repo, help="Questions in flight per repo")
+    parser.add_argument("--llm-concurrency", type=int, help="Calls in flight per LLM backend "
+                                                            "(default LLM_MAX_CONCURRENCY)")
+    parser.add_argument("--system-prompt", default=init_system_prompt)
+    parser.add_argument("--restart", action="store_true", help="Overwrite the output instead of resuming")
+    args = parser.parse_args()
+
+    if args.llm_concurrency:
+        # Read when the backend's semaphore is first created
+        llm_client.max_concurrency = args.llm_concurrency
+    questions = read_questions(args.questions, args.id_field, args.question_field, args.repo_field, args.repo)
+    counts = run_batch(questions, args.output, args.workers, args.per_repo, args.system_prompt,
+                       resume=not args.restart)
+    print(json.dumps(dict(counts, stages=metrics.snapshot()), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+import faiss
+import ann_index
+from knowledge_base import read_vdb_header, read_faiss_index
+
+# Recall, latency and memory of the VDB index types against exact search:
+#   python -m benchmarks.ann_index --vectors 1000000 --dim 768  (or --vdb ./vdb-<repo>)
+
+# Search knob swept per index type
+SWEEPS = {
+    "Flat": (None, [None]),
+    "SQ8": (None, [None]),
+    "IVFFlat": ("nprobe", [1, 4, 16, 64]),
+    "IVFSQ8": ("nprobe", [1, 4, 16, 64]),
+    "IVFPQ": ("nprobe", [1, 4, 16, 64]),
+    "HNSW": ("ef_search", [16, 32, 64, 128]),
+    "HNSWSQ8": ("ef_search", [16, 32, 64, 128]),
+}
+
+
+def synthetic_corpus(count, dim, clusters=256, seed=0):
+    # Embeddings of code chunks are clustered rather than uniform; normalized like sentence embeddings
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    vectors = centers[rng.integers(0, clusters, count)] + 0.5 * rng.standard_normal((count, dim), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def repo_corpus(vdb_path):
+    header = read_vdb_header(vdb_path)
+    if header is None:
+        raise SystemExit(f"No VDB found at {vdb_path}")
+    index = read_faiss_index(os.path.join(vdb_path, header["files"]["index"]), use_mmap=False)
+    if not (ann_index.is_positional(index) or isinstance(index, faiss.IndexIDMap)):
+        raise SystemExit("The vectors can only be read back from a Flat, SQ8 or HNSW store")
+    return np.ascontiguousarray(ann_index.labeled_vectors(index)[0], dtype=np.float32)
+
+
+def make_queries(vectors, count, seed=1):
+    # Perturbed corpus vectors, so every query has close neighbours as a real question would
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.integers(0, len(vectors), count)].copy()
+    queries += 0.05 * rng.standard_normal(queries.shape, dtype=np.float32) * np.abs(queries).mean()
+    return queries
+
+
+def measure(index, queries, truth, k, knob_name, knob):
+    params = ann_index.search_parameters(index, **{knob_name: knob}) if knob_name else None
+    latencies, found = [], []
+    for query in queries:
+        start = time.perf_counter()
+        _, labels = index.search(query[None, :], k, params=params)
+        latencies.append(time.perf_counter() - start)
+        found.append(labels[0])
+    recall = np.mean([len(set(row) & set(expected)) / k for row, expected in zip(found, truth)])
+    return {
+        knob_name or "knob": knob,
+        "recall_at_k": float(recall),
+        "latency_p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "latency_p95_ms": float(np.percentile(latencies, 95) * 1000),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark VDB index types: recall vs latency vs memory")
+    parser.add_argument("--vectors", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--vdb", help="Use the vectors of an existing VDB folder instead of a synthetic corpus")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--types", default=",".join(ann_index.INDEX_TYPES))
+    args = parser.parse_args()
+
+    vectors = repo_corpus(args.vdb) if args.vdb else synthetic_corpus(args.vectors, args.dim)
+    queries = make_queries(vectors, args.queries)
+    labels = np.arange(len(vectors), dtype=np.int64)
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, args.k)
+
+    results = []
+    for kind in args.types.split(","):
+        start = time.perf_counter()
+        index = exact if kind == "Flat" else ann_index.build_index(vectors, labels, kind)
+        build_seconds = time.perf_counter() - start if kind != "Flat" else 0.0
+        result = {
+            "type": kind,
+            "factory": ann_index.factory_string(kind, vectors.shape[1], len(vectors)),
+            "build_seconds": build_seconds,
+            "serialized_bytes": int(faiss.serialize_index(index).size),
+            "estimated_bytes": int(ann_index.index_bytes(index)),
+            "runs": [measure(index, queries, truth, args.k, SWEEPS[kind][0], knob) for knob in SWEEPS[kind][1]],
+        }
+        results.append(result)
+        print(json.dumps({"type": kind, "build_seconds": round(build_seconds, 2),
+                          "serialized_bytes": result["serialized_bytes"]}), flush=True)
+
+    print(json.dumps({"vectors": len(vectors), "dim": int(vectors.shape[1]), "queries": args.queries, "k": args.k,
+                      "corpus": args.vdb or "synthetic", "faiss": faiss.__version__, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
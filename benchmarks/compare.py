@@ -0,0 +1,43 @@
+import argparse
+import json
+
+# Compares the summaries of two benchmark runs: python -m benchmarks.compare before.json after.json
+
+
+def flatten(value, prefix=""):
+    if isinstance(value, dict):
+        items = {}
+        for key, child in value.items():
+            items.update(flatten(child, f"{prefix}.{key}" if prefix else str(key)))
+        return items
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: value}
+    return {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark JSON results")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=0.0, help="Only show changes above this fraction")
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    print(f"before: {before.get('commit')}  after: {after.get('commit')}")
+    if before.get("config") != after.get("config"):
+        print("Warning: the runs used different configurations")
+
+    old, new = flatten({k: v for k, v in before.items() if k != "config"}), \
+        flatten({k: v for k, v in after.items() if k != "config"})
+    width = max((len(key) for key in old), default=10)
+    for key in sorted(old.keys() & new.keys()):
+        change = (new[key] - old[key]) / old[key] if old[key] else 0.0
+        if abs(change) >= args.threshold:
+            print(f"{key:<{width}}  {old[key]:>14.4f}  {new[key]:>14.4f}  {change:>+8.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+import argparse
+import contextlib
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from lexical_index import tokenize
+from benchmarks.fake_llm import FakeLLMConfig, FakeLLMServer
+from benchmarks.synthetic_repo import generate_repo
+
+# Offline benchmark of the whole pipeline against the fake LLM server (see the Benchmarks section of README.md):
+#   python -m benchmarks.end_to_end --files 500 --sessions 1,4,16 --output result.json
+
+
+class HashEmbeddings(Embeddings):
+    # Feature hashing of the identifier tokens: deterministic, no download, and texts sharing names stay close
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    def embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in tokenize(text):
+            digest = zlib.crc32(token.encode())
+            vector[digest % self.dim] += 1.0 if digest & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed_documents(self, texts):
+        return np.asarray([self.embed(text) for text in texts], dtype=np.float32)
+
+    def embed_query(self, text):
+        return list(map(float, self.embed(text)))
+
+
+GENERAL_QUESTIONS = [
+    "What is the usage of this repo?",
+    "How does the code handle the session cache?",
+    "Where is the configuration loaded?",
+    "Which function parses incoming messages?",
+    "How are files split and stored in this repo?",
+    "How to use the python asyncio library?",
+]
+IDENTIFIER_QUESTIONS = [
+    "How to use the function {name}?",
+    "What does `{name}` return?",
+    "Where is {name} called?",
+]
+
+
+def make_questions(names, count, seed=0):
+    # Alternates questions about functions of the repo with general ones
+    rng = random.Random(seed)
+    questions = []
+    for i in range(count):
+        if i % 2 == 0:
+            name = rng.choice(rng.choice(names))
+            questions.append(rng.choice(IDENTIFIER_QUESTIONS).format(name=name))
+        else:
+            questions.append(GENERAL_QUESTIONS[(i // 2) % len(GENERAL_QUESTIONS)])
+    return questions
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def latency_summary(seconds):
+    if not seconds:
+        return {"count": 0}
+    values = np.asarray(seconds) * 1000
+    return {"count": len(values), "mean_ms": float(values.mean()), "p50_ms": float(np.percentile(values, 50)),
+            "p95_ms": float(np.percentile(values, 95)), "max_ms": float(values.max())}
+
+
+def folder_bytes(path):
+    return {name: os.path.getsize(os.path.join(path, name)) for name in sorted(os.listdir(path))
+            if os.path.isfile(os.path.join(path, name))}
+
+
+def git_commit():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=root, check=True, capture_output=True,
+                                text=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=root, check=True,
+                               capture_output=True, text=True).stdout.strip() != ""
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def configure(args, work_dir, api_base):
+    # Must run before the repo modules are imported: they read their settings at import time
+    os.environ.update({
+        "OPENAI_API_BASE": api_base,
+        "LLM_TYPE": "local",
+        "LLM_CACHE": "1" if args.llm_cache else "0",
+        "LLM_CACHE_PATH": os.path.join(work_dir, "llm_cache.sqlite"),
+        "EMBEDDING_TYPE": "local",
+        "EMBEDDING_CACHE_PATH": os.path.join(work_dir, "embedding_cache.sqlite"),
+    })
+    if args.embedding == "hash":
+        import registry
+        from embedding_cache import CachedEmbeddings
+        registry.get_singleton("embedding:local",
+                               lambda: CachedEmbeddings(HashEmbeddings(args.dim), f"hash:{args.dim}"))
+
+
+def build_phase(remote_url):
+    from repo_parser import sync_repo, get_readme, get_repo_structure, get_vdb_path, \
+        generate_or_load_knowledge_from_repo, generate_or_load_symbol_index, generate_or_load_call_graph
+
+    os.makedirs("./code_repo", exist_ok=True)
+    (repo_folder, _), clone_seconds = timed(sync_repo, remote_url, "./code_repo")
+    _, summary_seconds = timed(lambda: (get_readme(repo_folder), get_repo_structure(repo_folder)))
+    vdb, index_seconds = timed(generate_or_load_knowledge_from_repo, repo_folder)
+    _, symbol_index_seconds = timed(generate_or_load_symbol_index, repo_folder)
+    _, call_graph_seconds = timed(generate_or_load_call_graph, repo_folder)
+    # Analyzing the same repo again: fetch with nothing new, and a manifest diff with nothing to re-index
+    _, update_seconds = timed(sync_repo, remote_url, "./code_repo")
+    _, reindex_seconds = timed(generate_or_load_knowledge_from_repo, repo_folder)
+
+    files = folder_bytes(get_vdb_path(repo_folder))
+    return repo_folder, {
+        "clone_seconds": clone_seconds,
+        "summary_seconds": summary_seconds,
+        "index_seconds": index_seconds,
+        "symbol_index_seconds": symbol_index_seconds,
+        "call_graph_seconds": call_graph_seconds,
+        "update_seconds": update_seconds,
+        "reindex_unchanged_seconds": reindex_seconds,
+        "chunks": int(vdb.index.ntotal),
+        "index_bytes": sum(files.values()),
+        "index_files": files,
+    }
+
+
+def load_phase(repo_folder):
+    # Loads from disk after dropping the resident copies; the files are in the page cache by now
+    import registry
+    from repo_parser import get_vdb_path, load_knowledge_from_repo, load_lexical_index, load_symbol_index, \
+        load_call_graph
+
+    vdb_path = get_vdb_path(repo_folder)
+    for key in [vdb_path] + [os.path.join(vdb_path, name) for name in ("lexical.json", "symbols.json",
+                                                                        "callgraph.json")]:
+        registry.invalidate(key)
+    return {
+        "vdb_load_seconds": timed(load_knowledge_from_repo, repo_folder)[1],
+        "lexical_index_load_seconds": timed(load_lexical_index, repo_folder)[1],
+        "symbol_index_load_seconds": timed(load_symbol_index, repo_folder)[1],
+        "call_graph_load_seconds": timed(load_call_graph, repo_folder)[1],
+    }
+
+
+def question_phase(questions, repo_folder):
+    import router
+    import tool_planner
+
+    # The router embeds its examples on first use
+    router.route(questions[0], repo_folder)
+    records = []
+    for question in questions:
+        routed, route_seconds = timed(router.route, question, repo_folder)
+        _, retrieval_seconds = timed(tool_planner.retrieve_repo_context, question, repo_folder)
+        (header, chunks), plan_seconds = timed(tool_planner.plan_context, question, repo_folder)
+        records.append({"question": question, "route": routed[0] if routed else "LLM",
+                        "route_ms": route_seconds * 1000, "retrieval_ms": retrieval_seconds * 1000,
+                        "plan_ms": plan_seconds * 1000, "chunks": len(chunks),
+                        "context_chars": len(header) + sum(len(chunk) for chunk in chunks)})
+    return {
+        "routed_locally": sum(1 for record in records if record["route"] != "LLM") / len(records),
+        "route": latency_summary([record["route_ms"] / 1000 for record in records]),
+        "retrieval": latency_summary([record["retrieval_ms"] / 1000 for record in records]),
+        "plan": latency_summary([record["plan_ms"] / 1000 for record in records]),
+        "records": records,
+    }
+
+
+def ask(question, repo_folder, chatbot, history, chat_counter, memory):
+    # One turn through generate_response, timed like the GUI sees it (updates are coalesced, see sse.coalesce)
+    import code_learner
+
+    start = time.perf_counter()
+    first_token = None
+    for chatbot, history, chat_counter, memory in code_learner.generate_response(
+            code_learner.init_system_prompt, question, 0.5, 0.5, chat_counter, chatbot, history, repo_folder,
+            memory):
+        if first_token is None and history[-1]:
+            first_token = time.perf_counter() - start
+    total = time.perf_counter() - start
+    return {"ttft": first_token if first_token is not None else total, "total": total,
+            "answer_chars": len(history[-1])}, chatbot, history, chat_counter, memory
+
+
+def session(questions, repo_folder):
+    chatbot, history, chat_counter, memory, results = [], [], 0, None, []
+    for question in questions:
+        result, chatbot, history, chat_counter, memory = ask(question, repo_folder, chatbot, history, chat_counter,
+                                                             memory)
+        results.append(result)
+    return results
+
+
+def response_summary(results):
+    return {"ttft": latency_summary([result["ttft"] for result in results]),
+            "total": latency_summary([result["total"] for result in results]),
+            "answer_chars": sum(result["answer_chars"] for result in results)}
+
+
+def throughput_phase(questions, repo_folder, sessions, turns):
+    runs = {}
+    for count in sessions:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=count) as executor:
+            futures = [executor.submit(session, [questions[(i * turns + turn) % len(questions)]
+                                                 for turn in range(turns)], repo_folder) for i in range(count)]
+            results = [result for future in futures for result in future.result()]
+        wall = time.perf_counter() - start
+        runs[str(count)] = dict(response_summary(results), sessions=count, questions=len(results),
+                                wall_seconds=wall, questions_per_second=len(results) / wall)
+    return runs
+
+
+def run(args, server):
+    work_dir = args.work_dir
+    remote = os.path.join(work_dir, "remote", "synthetic")
+    names = generate_repo(remote, args.files, args.functions, args.seed, bare=True)
+    os.chdir(work_dir)
+    configure(args, work_dir, server.api_base)
+
+    print("Building the indexes...", file=sys.stderr)
+    repo_folder, build = build_phase(remote + ".git")
+    load = load_phase(repo_folder)
+    questions = make_questions(names, args.questions, args.seed)
+    print("Asking questions...", file=sys.stderr)
+    planning = question_phase(questions, repo_folder)
+    responses = [session([question], repo_folder)[0] for question in questions]
+    print("Running concurrent sessions...", file=sys.stderr)
+    throughput = throughput_phase(questions, repo_folder, args.sessions, args.turns)
+    import metrics
+    return {"build": build, "load": load, "questions": planning, "generate_response": response_summary(responses),
+            "throughput": throughput, "stages": metrics.snapshot()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark against a fake LLM server")
+    parser.add_argument("--files", type=int, default=200, help="Python modules in the synthetic repo")
+    parser.add_argument("--functions", type=int, default=10, help="Functions per module")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--questions", type=int, default=20)
+    parser.add_argument("--sessions", default="1,4,16", help="Concurrent session counts to measure")
+    parser.add_argument("--turns", type=int, default=3, help="Questions per session in the throughput runs")
+    parser.add_argument("--first-token-ms", type=float, default=200)
+    parser.add_argument("--token-ms", type=float, default=10)
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--completion-ms", type=float, default=300)
+    parser.add_argument("--tool", default="Repo_Parser", choices=["Code_Searcher", "Repo_Parser", "No_Tool"],
+                        help="Answer of the fake LLM to tool selection")
+    parser.add_argument("--embedding", default="hash", choices=["hash", "local"])
+    parser.add_argument("--dim", type=int, default=256, help="Dimension of the hash embeddings")
+    parser.add_argument("--llm-cache", action="store_true", help="Keep the LLM response cache enabled")
+    parser.add_argument("--work-dir", help="Keep the repo, indexes and caches in this folder")
+    parser.add_argument("--output", help="Also write the JSON result to this file")
+    args = parser.parse_args()
+    args.sessions = [int(count) for count in args.sessions.split(",")]
+    output = os.path.abspath(args.output) if args.output else None
+    keep = args.work_dir is not None
+    args.work_dir = os.path.abspath(args.work_dir) if keep else tempfile.mkdtemp(prefix="code-learner-bench-")
+    os.makedirs(args.work_dir, exist_ok=True)
+
+    config = FakeLLMConfig(args.first_token_ms / 1000, args.token_ms / 1000, args.tokens, args.completion_ms / 1000,
+                           args.tool)
+    server = FakeLLMServer(config).start()
+    cwd = os.getcwd()
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            results = run(args, server)
+    finally:
+        server.stop()
+        os.chdir(cwd)
+        if not keep:
+            shutil.rmtree(args.work_dir, ignore_errors=True)
+
+    commit, dirty = git_commit()
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "config": {"files": args.files, "functions": args.functions, "seed": args.seed, "questions": args.questions,
+                   "turns": args.turns, "first_token_ms": args.first_token_ms, "token_ms": args.token_ms,
+                   "tokens": args.tokens, "completion_ms": args.completion_ms, "tool": args.tool,
+                   "embedding": args.embedding, "dim": args.dim, "llm_cache": args.llm_cache},
+        **results,
+    }
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# OpenAI-compatible stub server with configurable latency: python -m benchmarks.fake_llm --port 8080
+
+IDENTIFIER_RE = re.compile(r"\b[A-Za-z_]\w*_\w*\b")
+FILLER = ("The function reads the repository files, splits them into chunks and stores their embeddings "
+          "so that related code can be found for each question. ").split(" ")
+
+
+class FakeLLMConfig:
+    def __init__(self, first_token_delay=0.2, token_delay=0.01, tokens=100, completion_delay=0.3,
+                 tool="Repo_Parser", failures=0):
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.tokens = tokens
+        # Latency of non-streaming requests (tool selection, name extraction, README summary)
+        self.completion_delay = completion_delay
+        self.tool = tool
+        # The first `failures` requests are answered with 503, to exercise the clients' retries
+        self.failures = failures
+
+
+def prompt_text(body):
+    if "messages" in body:
+        return "\n".join(message.get("content") or "" for message in body["messages"])
+    prompt = body.get("prompt", "")
+    return "\n".join(prompt) if isinstance(prompt, list) else prompt
+
+
+def answer_for(prompt, config):
+    if "tool recommender" in prompt:
+        return config.tool
+    if "extract the function or variable name" in prompt:
+        question = prompt.rsplit("Here is the user input:", 1)[-1]
+        names = IDENTIFIER_RE.findall(question)
+        return names[0] if names else "main"
+    return " ".join(FILLER[i % len(FILLER)] for i in range(config.tokens))
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = FakeLLMConfig()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        with self.server.lock:
+            self.server.requests += 1
+            failing = self.server.requests <= self.config.failures
+        if failing:
+            self.send_json(503, {"error": {"message": "Service unavailable", "type": "server_error"}})
+            return
+        if self.path.endswith("/chat/completions"):
+            chat = True
+        elif self.path.endswith("/completions"):
+            chat = False
+        else:
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+        text = answer_for(prompt_text(body), self.config)
+        if body.get("stream"):
+            self.stream(text, chat, body.get("model", ""))
+        else:
+            time.sleep(self.config.completion_delay)
+            self.send_json(200, completion_response(text, chat, body.get("model", "")))
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def write_chunk(self, text):
+        data = text.encode()
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def stream(self, text, chat, model):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        if chat:
+            self.write_chunk(sse_event(stream_chunk(None, chat, model, role=True)))
+        time.sleep(self.config.first_token_delay)
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(self.config.token_delay)
+            self.write_chunk(sse_event(stream_chunk(word if i == 0 else " " + word, chat, model)))
+        self.write_chunk(sse_event(stream_chunk(None, chat, model, finish=True)))
+        self.write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def sse_event(payload):
+    return "data: " + json.dumps(payload) + "\n\n"
+
+
+def stream_chunk(content, chat, model, role=False, finish=False):
+    if chat:
+        delta = {"role": "assistant"} if role else ({} if content is None else {"content": content})
+        choice = {"index": 0, "delta": delta, "finish_reason": "stop" if finish else None}
+        return {"object": "chat.completion.chunk", "model": model, "choices": [choice]}
+    choice = {"index": 0, "text": content or "", "finish_reason": "stop" if finish else None}
+    return {"object": "text_completion", "model": model, "choices": [choice]}
+
+
+def completion_response(text, chat, model):
+    tokens = len(text.split(" "))
+    usage = {"prompt_tokens": 1, "completion_tokens": tokens, "total_tokens": tokens + 1}
+    if chat:
+        choice = {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}
+        return {"object": "chat.completion", "model": model, "choices": [choice], "usage": usage}
+    choice = {"index": 0, "text": text, "finish_reason": "stop"}
+    return {"object": "text_completion", "model": model, "choices": [choice], "usage": usage}
+
+
+class FakeLLMServer:
+    # Runs the stub in a background thread; port 0 picks a free port
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        handler = type("ConfiguredFakeLLMHandler", (FakeLLMHandler,), {"config": config or FakeLLMConfig()})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.requests = 0
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    @property
+    def api_base(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub LLM server with configurable latency")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--first-token-ms", type=float, default=200)
+    parser.add_argument("--token-ms", type=float, default=10)
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--completion-ms", type=float, default=300)
+    parser.add_argument("--tool", default="Repo_Parser", choices=["Code_Searcher", "Repo_Parser", "No_Tool"])
+    args = parser.parse_args()
+
+    config = FakeLLMConfig(args.first_token_ms / 1000, args.token_ms / 1000, args.tokens, args.completion_ms / 1000,
+                           args.tool)
+    server = FakeLLMServer(config, args.host, args.port)
+    print(f"Fake LLM server listening on {server.api_base}")
+    server.server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
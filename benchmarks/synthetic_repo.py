@@ -0,0 +1,111 @@
+import argparse
+import os
+import random
+import subprocess
+
+# Deterministic synthetic git repo for benchmarks: python -m benchmarks.synthetic_repo /tmp/synthetic --bare
+
+WORDS = ("buffer cache client config connection embedding event file handler index loader message model "
+         "parser queue request response router schema session settings storage stream task token user "
+         "worker").split()
+VERBS = ("build", "check", "close", "compute", "convert", "fetch", "load", "merge", "open", "parse", "read",
+         "refresh", "register", "render", "resolve", "save", "send", "split", "update", "validate")
+files_per_package = 50
+docs_every = 20
+
+
+def module_path(index):
+    return f"pkg_{index // files_per_package}/module_{index}.py"
+
+
+def function_name(rng, module, position):
+    return f"{rng.choice(VERBS)}_{rng.choice(WORDS)}_{module}_{position}"
+
+
+def generate_names(files, functions, seed):
+    rng = random.Random(seed)
+    return [[function_name(rng, module, position) for position in range(functions)] for module in range(files)]
+
+
+def render_module(rng, module, names, files):
+    lines = [f'"""Handles the {rng.choice(WORDS)} and {rng.choice(WORDS)} logic of module {module}."""', "import os"]
+    callees = sorted({rng.randrange(files) for _ in range(3)} - {module})
+    for callee in callees:
+        lines.append(f"from pkg_{callee // files_per_package}.module_{callee} import "
+                     + ", ".join(names[callee][:2]))
+    for position, name in enumerate(names[module]):
+        subject, other = rng.choice(WORDS), rng.choice(WORDS)
+        lines += ["", "", f"def {name}({subject}, {other}=None):",
+                  f'    """{name.split("_")[0].capitalize()} the {subject} using the {other} settings."""',
+                  f"    result = {{'{subject}': {subject}, 'path': os.path.join('{subject}', '{other}')}}"]
+        for callee in callees[:2]:
+            if rng.random() < 0.5:
+                lines.append(f"    result['{callee}'] = {rng.choice(names[callee][:2])}({subject})")
+        if position:
+            lines.append(f"    result['previous'] = {names[module][position - 1]}({subject})")
+        lines += [f"    if {other} is not None:", f"        result['{other}'] = {other}", "    return result"]
+    return "\n".join(lines) + "\n"
+
+
+def render_doc(rng, doc, names):
+    topic = rng.choice(WORDS)
+    lines = [f"# {topic.capitalize()} guide {doc}", ""]
+    for _ in range(8):
+        module = rng.randrange(len(names))
+        lines.append(f"The {topic} {rng.choice(WORDS)} is handled by `{rng.choice(names[module])}` in "
+                     f"`{module_path(module)}`, which {rng.choice(VERBS)}s the {rng.choice(WORDS)}.")
+    return "\n".join(lines) + "\n"
+
+
+def render_readme(files, functions):
+    return (f"# Synthetic project\n\nA generated code base with {files} modules of {functions} functions each, "
+            "used to benchmark GPT-Code-Learner.\n\n## Layout\n\n- `pkg_*/module_*.py`: the modules\n"
+            "- `docs/`: usage guides\n")
+
+
+def git(args, cwd):
+    env = dict(os.environ, GIT_AUTHOR_NAME="bench", GIT_AUTHOR_EMAIL="bench@example.com",
+               GIT_COMMITTER_NAME="bench", GIT_COMMITTER_EMAIL="bench@example.com")
+    subprocess.run(["git"] + args, cwd=cwd, env=env, check=True, capture_output=True, text=True)
+
+
+def generate_repo(path, files=200, functions=10, seed=0, bare=False):
+    # Returns the function names per module, so benchmarks can ask about code that exists
+    names = generate_names(files, functions, seed)
+    rng = random.Random(seed + 1)
+    for module in range(files):
+        filepath = os.path.join(path, module_path(module))
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(filepath, "w") as f:
+            f.write(render_module(rng, module, names, files))
+    for package in range((files + files_per_package - 1) // files_per_package):
+        open(os.path.join(path, f"pkg_{package}", "__init__.py"), "w").close()
+    os.makedirs(os.path.join(path, "docs"), exist_ok=True)
+    for doc in range(max(1, files // docs_every)):
+        with open(os.path.join(path, "docs", f"guide_{doc}.md"), "w") as f:
+            f.write(render_doc(rng, doc, names))
+    with open(os.path.join(path, "README.md"), "w") as f:
+        f.write(render_readme(files, functions))
+
+    git(["init", "-q"], path)
+    git(["add", "-A"], path)
+    git(["commit", "-q", "-m", f"Synthetic repo with {files} modules"], path)
+    if bare:
+        git(["clone", "-q", "--bare", path, path.rstrip("/") + ".git"], None)
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic git repo for benchmarks")
+    parser.add_argument("path")
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--functions", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--bare", action="store_true")
+    args = parser.parse_args()
+    generate_repo(args.path, args.files, args.functions, args.seed, args.bare)
+    print(f"Generated {args.files} modules in {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import argparse
+import json
+import os
+import pickle
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import faiss
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from knowledge_base import empty_vdb, add_embeddings_to_vdb, save_local_vdb, load_local_vdb, load_pickled_vdb
+
+# Cold load time and memory of the pickled VDB vs the on-disk format, each in a fresh process:
+#   python -m benchmarks.vdb_load --chunks 200000 --dim 768
+
+
+class RandomEmbeddings(Embeddings):
+    def __init__(self, dim=768):
+        self.dim = dim
+
+    def embed_documents(self, texts):
+        return np.random.rand(len(texts), self.dim).astype(np.float32)
+
+    def embed_query(self, text):
+        return list(map(float, np.random.rand(self.dim)))
+
+
+def current_rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def build_store(work_dir, chunks, dim):
+    embedding = RandomEmbeddings(dim)
+    vdb = empty_vdb(embedding, dim)
+    rng = np.random.default_rng(0)
+    batch = 10000
+    for start in range(0, chunks, batch):
+        count = min(batch, chunks - start)
+        docs = [Document(page_content=f"def function_{i}():\n    return {i}\n" * 20,
+                         metadata={"source": f"./code_repo/synthetic/file_{i // 10}.py"})
+                for i in range(start, start + count)]
+        add_embeddings_to_vdb(vdb, docs, rng.random((count, dim), dtype=np.float32))
+
+    pkl_path = os.path.join(work_dir, "vdb.pkl")
+    with open(pkl_path, "wb") as f:
+        pickle.dump(vdb, f)
+    vdb_path = os.path.join(work_dir, "vdb")
+    save_local_vdb(vdb, vdb_path)
+    return pkl_path, vdb_path
+
+
+def measure_child(mode, path, dim):
+    rss_before = current_rss_bytes()
+    start = time.perf_counter()
+    if mode == "pickle":
+        vdb = load_pickled_vdb(path)
+    else:
+        vdb = load_local_vdb(path, RandomEmbeddings(dim), use_mmap=(mode == "mmap"))
+    load_seconds = time.perf_counter() - start
+
+    query = np.random.rand(1, dim).astype(np.float32)
+    start = time.perf_counter()
+    _, indices = vdb.index.search(query, 10)
+    for i in indices[0]:
+        if i != -1:
+            vdb.docstore.search(vdb.index_to_docstore_id[int(i)])
+    first_query_seconds = time.perf_counter() - start
+
+    return {
+        "mode": mode,
+        "load_seconds": load_seconds,
+        "first_query_seconds": first_query_seconds,
+        "rss_delta_bytes": current_rss_bytes() - rss_before,
+        "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+
+def run_child(mode, path, dim):
+    output = subprocess.check_output(
+        [sys.executable, "-m", "benchmarks.vdb_load", "--child", mode, "--path", path, "--dim", str(dim)])
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark VDB load time and memory")
+    parser.add_argument("--chunks", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--child", choices=["pickle", "full", "mmap"])
+    parser.add_argument("--path")
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure_child(args.child, args.path, args.dim)))
+        return
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        pkl_path, vdb_path = build_store(work_dir, args.chunks, args.dim)
+        sizes = {
+            "pickle_bytes": os.path.getsize(pkl_path),
+            "vdb_bytes": sum(os.path.getsize(os.path.join(vdb_path, name)) for name in os.listdir(vdb_path)),
+        }
+        runs = []
+        for _ in range(args.repeat):
+            runs.append(run_child("pickle", pkl_path, args.dim))
+            runs.append(run_child("full", vdb_path, args.dim))
+            runs.append(run_child("mmap", vdb_path, args.dim))
+
+    summary = {}
+    for mode in ["pickle", "full", "mmap"]:
+        mode_runs = [run for run in runs if run["mode"] == mode]
+        summary[mode] = {key: float(np.median([run[key] for run in mode_runs]))
+                         for key in ["load_seconds", "first_query_seconds", "rss_delta_bytes", "max_rss_bytes"]}
+    print(json.dumps({"chunks": args.chunks, "dim": args.dim, "faiss": faiss.__version__,
+                      "sizes": sizes, "results": summary}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+import os
+import re
+import ast
+import json
+from symbol_index import read_text_lines
+
+# Definitions, call sites and imports of every file, aggregated into a definition -> callers/callees graph.
+# Python files are parsed with `ast`; other languages use a lightweight tokenizer fallback.
+CALL_GRAPH_VERSION = 2
+max_block_lines = 300
+
+DEF_RE = re.compile(r"\b(?:def|function|func|fn|class|struct|interface|enum|trait|type|sub|procedure|module|object)"
+                    r"\s+\*?([A-Za-z_][A-Za-z0-9_]*)")
+# e.g. "static int foo(int a) {" or "public void Foo()", but not a call statement ending with ";"
+C_DEF_RE = re.compile(r"^\s*(?:[A-Za-z_][\w:<>,\*&\[\]]*\s+)+\**([A-Za-z_][A-Za-z0-9_]*)\s*\([^;]*$")
+# e.g. "const foo = (a) => {" or "foo: function (a) {"
+JS_DEF_RE = re.compile(r"\b([A-Za-z_$][\w$]*)\s*[:=]\s*(?:async\s+)?(?:function\b|\([^)]*\)\s*=>|[A-Za-z_]\w*\s*=>)")
+CALL_RE = re.compile(r"\b([A-Za-z_][A-Za-z0-9_]*)\s*\(")
+IMPORT_RE = re.compile(r"^\s*(?:import|from|#\s*include|require|use|using|package)\b")
+STRING_RE = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|`(?:\\.|[^`\\])*`')
+COMMENT_RE = re.compile(r"//.*$|(?<![\w$])#(?!\s*include).*$|--\s.*$")
+NOT_CALLS = {"if", "for", "while", "switch", "return", "catch", "sizeof", "elif", "and", "or", "not", "in",
+             "with", "assert", "print", "super", "new", "typeof", "function", "def", "fn", "func", "lambda"}
+
+
+def python_symbols(source):
+    tree = ast.parse(source)
+    definitions, calls, imports = [], [], []
+
+    def visit(node, scope):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                qualname = ".".join(scope + [child.name])
+                definitions.append({
+                    "name": child.name,
+                    "qualname": qualname,
+                    "kind": "class" if isinstance(child, ast.ClassDef) else "function",
+                    # Decorators belong to the definition block
+                    "line": min([child.lineno] + [d.lineno for d in child.decorator_list]),
+                    "end_line": getattr(child, "end_lineno", child.lineno),
+                })
+                visit(child, scope + [child.name])
+                continue
+            if isinstance(child, ast.Call):
+                func = child.func
+                name = func.id if isinstance(func, ast.Name) else func.attr if isinstance(func, ast.Attribute) else None
+                if name is not None:
+                    calls.append({"name": name, "line": child.lineno, "caller": ".".join(scope) or "<module>"})
+            elif isinstance(child, ast.Import):
+                imports.extend({"name": alias.asname or alias.name, "module": alias.name, "line": child.lineno}
+                               for alias in child.names)
+            elif isinstance(child, ast.ImportFrom):
+                imports.extend({"name": alias.asname or alias.name, "module": child.module or "", "line": child.lineno}
+                               for alias in child.names)
+            visit(child, scope)
+
+    visit(tree, [])
+    return definitions, calls, imports
+
+
+def block_end(lines, start):
+    # End of a definition block: matching braces when the block uses them, indentation otherwise
+    depth, seen_brace = 0, False
+    limit = min(len(lines), start + max_block_lines)
+    for number in range(start, limit + 1):
+        code = COMMENT_RE.sub("", STRING_RE.sub('""', lines[number - 1]))
+        depth += code.count("{") - code.count("}")
+        seen_brace = seen_brace or "{" in code
+        if seen_brace and depth <= 0:
+            return number
+        if not seen_brace and code.strip().endswith(";"):
+            # Declaration without a body
+            return start
+    if seen_brace:
+        return limit
+    indent = len(lines[start - 1]) - len(lines[start - 1].lstrip())
+    end = start
+    for number in range(start + 1, limit + 1):
+        line = lines[number - 1]
+        if line.strip():
+            if len(line) - len(line.lstrip()) <= indent:
+                break
+            end = number
+    return end
+
+
+def generic_symbols(lines):
+    definitions, calls, imports = [], [], []
+    for number, line in enumerate(lines, start=1):
+        code = COMMENT_RE.sub("", STRING_RE.sub('""', line))
+        if IMPORT_RE.match(line):
+            imports.append({"name": line.strip(), "module": line.strip(), "line": number})
+            continue
+        match = DEF_RE.search(code) or JS_DEF_RE.search(code) or C_DEF_RE.match(code)
+        defined = None
+        if match and match.group(1) not in NOT_CALLS:
+            defined = match.group(1)
+            definitions.append({"name": defined, "qualname": defined, "kind": "definition",
+                                "line": number, "end_line": block_end(lines, number)})
+        for call in CALL_RE.finditer(code):
+            if call.group(1) != defined and call.group(1) not in NOT_CALLS:
+                calls.append({"name": call.group(1), "line": number, "caller": None})
+
+    # Attribute each call to the innermost definition that contains it
+    for call in calls:
+        enclosing = [d for d in definitions if d["line"] <= call["line"] <= d["end_line"]]
+        call["caller"] = max(enclosing, key=lambda d: d["line"])["qualname"] if enclosing else "<module>"
+    return definitions, calls, imports
+
+
+def extract_symbols(filepath):
+    lines = read_text_lines(filepath)
+    if lines is None:
+        return {"definitions": [], "calls": [], "imports": []}
+    if filepath.endswith(".py"):
+        try:
+            definitions, calls, imports = python_symbols("\n".join(lines))
+            return {"definitions": definitions, "calls": calls, "imports": imports}
+        except (SyntaxError, ValueError):
+            pass
+    definitions, calls, imports = generic_symbols(lines)
+    return {"definitions": definitions, "calls": calls, "imports": imports}
+
+
+class CallGraph:
+    def __init__(self, files=None, root="."):
+        # files: path relative to root -> {"size", "mtime_ns", "hash", "definitions", "calls", "imports"}
+        self.files = files or {}
+        self.root = root
+        self._build()
+
+    def _build(self):
+        self.definitions = {}  # name or qualname -> [definition + filename]
+        self.callers = {}  # callee name -> [call site + filename]
+        self.callees = {}  # (filename, caller qualname) -> [callee names]
+        for filepath, entry in self.files.items():
+            for definition in entry["definitions"]:
+                record = dict(definition, filename=filepath)
+                self.definitions.setdefault(definition["name"], []).append(record)
+                if definition["qualname"] != definition["name"]:
+                    self.definitions.setdefault(definition["qualname"], []).append(record)
+            for call in entry["calls"]:
+                self.callers.setdefault(call["name"], []).append(dict(call, filename=filepath))
+                self.callees.setdefault((filepath, call["caller"]), []).append(call["name"])
+
+    @classmethod
+    def load(cls, path, root="."):
+        if not os.path.isfile(path):
+            return None
+        with open(path, "r") as f:
+            data = json.load(f)
+        if data.get("version") != CALL_GRAPH_VERSION:
+            return None
+        return cls(data["files"], root)
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": CALL_GRAPH_VERSION, "files": self.files}, f)
+        os.replace(tmp_path, path)
+
+    def update(self, files, changed, deleted):
+        # files/changed/deleted as returned by repo_parser.diff_repo_files
+        for filepath in deleted:
+            self.files.pop(filepath, None)
+        for filepath in changed:
+            self.files[filepath] = dict(files[filepath], **extract_symbols(os.path.join(self.root, filepath)))
+        for filepath, entry in files.items():
+            if filepath in self.files:
+                self.files[filepath].update(size=entry["size"], mtime_ns=entry["mtime_ns"])
+        self._build()
+
+    def find_definitions(self, name):
+        return self.definitions.get(name, [])
+
+    def find_callers(self, name, limit=None):
+        # Callers ranked by how often they call `name`, one entry per calling function
+        grouped = {}
+        for call in self.callers.get(name.split(".")[-1], []):
+            key = (call["filename"], call["caller"])
+            grouped.setdefault(key, []).append(call["line"])
+        ranked = sorted(grouped.items(), key=lambda item: (-len(item[1]), item[0]))
+        callers = [{"filename": filename, "caller": caller, "lines": sorted(lines)}
+                   for (filename, caller), lines in ranked]
+        return callers[:limit] if limit is not None else callers
+
+    def find_callees(self, definition):
+        names = self.callees.get((definition["filename"], definition["qualname"]), [])
+        return sorted(set(names), key=names.index)
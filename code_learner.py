@@ -1,21 +1,25 @@
 import gradio as gr
-import json
-import requests
 import os
+import time
 from termcolor import colored
-from repo_parser import clone_repo, generate_or_load_knowledge_from_repo
-import tool_planner
+from repo_parser import default_repo_folder
+import indexing_jobs
+import repo_watcher
+import context_packer
+import session_memory
+import metrics
+
+import llm_client
+from sse import iter_chat_deltas, coalesce, StreamError
 
 llm_type = os.environ.get('LLM_TYPE', "local")
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "null")
 if llm_type == "local":
-    API_URL = "http://localhost:8080/v1/chat/completions"
     model = "ggml-gpt4all-j"
 else:
-    API_URL = "https://api.openai.com/v1/chat/completions"
     model = "gpt-3.5-turbo"
 
 code_repo_path = "./code_repo"
+no_repo_message = "Please put the link of the repo to learn in the Repo Link box and click Analyze Code Repo first."
 
 init_system_prompt = """Now you are an expert programmer and teacher of a code repository. 
     You will be asked to explain the code for a specific task in the repo.
@@ -28,109 +32,114 @@ init_system_prompt = """Now you are an expert programmer and teacher of a code r
 system_prompt = init_system_prompt
 
 
-def generate_response(system_msg, inputs, top_p, temperature, chat_counter, chatbot=[], history=[]):
-    orig_inputs = inputs
-
-    # Inputs are pre-processed with extra tools
-    inputs = tool_planner.user_input_handler(inputs)
-
-    print("Inputs Length: ", len(inputs))
-    # Add checker for the input length to fitin the GPT model window size
-    if llm_type == "local":
-        token_limit = 2000
-    else:
-        token_limit = 8000
-    if len(inputs) > token_limit:
-        inputs = inputs[:token_limit]
+def time_first_token(deltas, start, trace_id):
+    # Measured on the raw deltas, before the UI updates are coalesced
+    first = True
+    for delta in deltas:
+        if first and delta:
+            metrics.observe("ttft", time.perf_counter() - start, trace=trace_id)
+            first = False
+        yield delta
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {OPENAI_API_KEY}"
-    }
 
+def build_messages(system_msg, chat_counter, chatbot, memory=None):
+    # Everything sent before the final user message: the system prompt and, after the first turn, the history
+    # (compacted by the session memory if there is one)
     if system_msg.strip() == '':
-        initial_message = [{"role": "user", "content": f"{inputs}"}]
+        initial_message = []
         multi_turn_message = []
     else:
-        initial_message = [{"role": "system", "content": system_msg},
-                           {"role": "user", "content": f"{inputs}"}]
+        initial_message = [{"role": "system", "content": system_msg}]
         multi_turn_message = [{"role": "system", "content": init_system_prompt}]
 
     if chat_counter == 0:
-        payload = {
-            "model": model,
-            "messages": initial_message,
-            "temperature": temperature,
-            "top_p": top_p,
-            "n": 1,
-            "stream": True,
-            "presence_penalty": 0,
-            "frequency_penalty": 0,
-        }
-    else:
-        messages = multi_turn_message
-        for data in chatbot:
-            user = {"role": "user", "content": data[0]}
-            assistant = {"role": "assistant", "content": data[1]}
-            messages.extend([user, assistant])
-        temp = {"role": "user", "content": inputs}
-        messages.append(temp)
-
-        payload = {
-            "model": model,
-            "messages": messages,
-            "temperature": temperature,
-            "top_p": top_p,
-            "n": 1,
-            "stream": True,
-            "presence_penalty": 0,
-            "frequency_penalty": 0, }
+        return initial_message
+    messages = multi_turn_message
+    if memory is not None:
+        return messages + memory.replay(chatbot)
+    for data in chatbot:
+        user = {"role": "user", "content": data[0]}
+        assistant = {"role": "assistant", "content": data[1]}
+        messages.extend([user, assistant])
+    return messages
+
+
+def chat_payload(messages, top_p, temperature):
+    return {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "top_p": top_p,
+        "n": 1,
+        "stream": True,
+        "presence_penalty": 0,
+        "frequency_penalty": 0,
+    }
+
+
+def generate_response(system_msg, inputs, top_p, temperature, chat_counter, chatbot=[], history=[],
+                      repo_folder=None, memory=None):
+    question_start = time.perf_counter()
+    orig_inputs = inputs
+    # Each session answers from the repo it analyzed
+    if repo_folder is None:
+        repo_folder = default_repo_folder(code_repo_path)
+    # Created on the first turn: gr.State copies its initial value into every session
+    if memory is None:
+        memory = session_memory.SessionMemory(model)
+    if repo_folder is None:
+        history.extend([orig_inputs, no_repo_message])
+        yield [(history[i], history[i + 1]) for i in range(0, len(history), 2)], history, chat_counter + 1, memory
+        return
+
+    # Inputs are pre-processed with extra tools, or reuse what the session retrieved for the same code;
+    # the spans of this question share a trace id
+    with metrics.trace() as trace_id:
+        header, chunks = memory.plan_context(inputs, repo_folder)
+
+    messages = build_messages(system_msg, chat_counter, chatbot, memory)
+    # Retrieved chunks fill the model window left after the system prompt, history and question
+    with metrics.trace(trace_id):
+        inputs = context_packer.pack_prompt(messages, header, chunks, model)
+    print("Inputs Length: ", len(inputs))
+    messages.append({"role": "user", "content": inputs})
+    payload = chat_payload(messages, top_p, temperature)
 
     chat_counter += 1
     history.append(orig_inputs)
     print(colored("Orig input from the user: ", "green"), colored(orig_inputs, "green"))
     print(colored("Input with tools: ", "blue"), colored(inputs, "blue"))
-    response = requests.post(API_URL, headers=headers, json=payload, stream=True)
-    token_counter = 0
+    # Pooled keep-alive connection, limited per backend
+    stream_start = time.perf_counter()
+    response = llm_client.stream_chat_completion(payload)
+
+    # Previous turns are built once; only the last pair changes while streaming
+    chat = [(history[i], history[i + 1]) for i in range(0, len(history) - 2, 2)]
+    chat.append((orig_inputs, ""))
+    history.append("")
     partial_words = ""
-
-    response_complete = False
-
-    counter = 0
-    for chunk in response.iter_lines():
-        if counter == 0:
-            counter += 1
-            continue
-
-        if response_complete:
-            print(colored("Response: ", "yellow"), colored(partial_words, "yellow"))
-
-        if chunk.decode():
-            chunk = chunk.decode()
-            if chunk.startswith("error:"):
-                print(colored("Chunk: ", "red"), colored(chunk, "red"))
-
-            # Check if the chatbot is done generating the response
-            try:
-                if len(chunk) > 12 and "finish_reason" in json.loads(chunk[6:])['choices'][0]:
-                    response_complete = json.loads(chunk[6:])['choices'][0].get("finish_reason", None) == "stop"
-            except:
-                print("Error in response_complete check")
-                pass
-
-            try:
-                if len(chunk) > 12 and "content" in json.loads(chunk[6:])['choices'][0]['delta']:
-                    partial_words = partial_words + json.loads(chunk[6:])['choices'][0]["delta"]["content"]
-                    if token_counter == 0:
-                        history.append(" " + partial_words)
-                    else:
-                        history[-1] = partial_words
-                    chat = [(history[i], history[i + 1]) for i in range(0, len(history) - 1, 2)]
-                    token_counter += 1
-                    yield chat, history, chat_counter, response
-            except:
-                print("Error in partial_words check")
-                pass
+    error = None
+    try:
+        for partial_words in coalesce(time_first_token(iter_chat_deltas(response), stream_start, trace_id)):
+            history[-1] = partial_words
+            chat[-1] = (orig_inputs, partial_words)
+            yield chat, history, chat_counter, memory
+    except StreamError as e:
+        error = type(e).__name__
+        print(colored("Stream error: ", "red"), colored(str(e), "red"))
+        history[-1] = partial_words + f"\n\n[Error: {e}]"
+        chat[-1] = (orig_inputs, history[-1])
+        yield chat, history, chat_counter, memory
+    finally:
+        response.close()
+        end = time.perf_counter()
+        metrics.observe("stream", end - stream_start,
+                        {"chars": len(partial_words), "tokens": context_packer.count_tokens(partial_words, model)},
+                        error, trace_id)
+        metrics.observe("question", end - question_start, None, error, trace_id)
+        # The history sent with the next question stays within its token budget, also after a disconnect
+        memory.record_turn(chat)
+    print(colored("Response: ", "yellow"), colored(partial_words, "yellow"))
 
 
 def reset_textbox():
@@ -145,17 +154,20 @@ def set_visible_true():
     return gr.update(visible=True)
 
 
-def analyze_repo(repo_url, progress=gr.Progress()):
-    progress(0, desc="Starting")
-    repo_information = clone_repo(repo_url, progress)
-
-    progress(0.6, desc="Building Knowledge Base")
-    generate_or_load_knowledge_from_repo()
-
-    if repo_information is not None:
-        return init_system_prompt + repo_information, "Analysis completed"
+def analyze_repo(repo_url):
+    # Starts (or joins) the background indexing job and binds the session to the repo right away, so questions
+    # use whatever is indexed so far; yields the system message, status and bound repo until the job finished
+    if not repo_url.strip():
+        yield gr.update(), "Please enter a repo link", None
+        return
+    job = indexing_jobs.submit(repo_url, code_repo_path)
+    yield gr.update(), job.status(), job.repo_folder
+    while not job.done.wait(1):
+        yield gr.update(), job.status(), gr.update()
+    if job.state == "failed":
+        yield init_system_prompt, job.status(), None
     else:
-        return init_system_prompt, "Analysis failed"
+        yield init_system_prompt + job.repo_information, job.status(), job.repo_folder
 
 def main():
     title = """<h1 align="center">GPT-Code-Learner</h1>"""
@@ -195,7 +207,9 @@ def main():
                 with gr.Column(scale=2):
                     analyze_progress = gr.Textbox(label="Status")
 
-            repo_link_btn.click(analyze_repo, [repo_url], [system_msg, analyze_progress])
+            # The repo this session analyzed; questions are answered from its indexes only
+            repo_state = gr.State(None)
+            repo_link_btn.click(analyze_repo, [repo_url], [system_msg, analyze_progress, repo_state])
 
             with gr.Row():
                 with gr.Column(scale=10):
@@ -205,6 +219,8 @@ def main():
                     )
 
             state = gr.State([])
+            # Conversation summary and retrieval results of this session (see session_memory)
+            memory_state = gr.State(None)
             with gr.Row():
                 with gr.Column(scale=8):
                     inputs = gr.Textbox(
@@ -230,10 +246,11 @@ def main():
                                         label="Temperature", )
                 chat_counter = gr.Number(value=0, visible=True, precision=0)
 
-        inputs.submit(generate_response, [system_msg, inputs, top_p, temperature, chat_counter, chatbot, state],
-                      [chatbot, state, chat_counter], )
-        b1.click(generate_response, [system_msg, inputs, top_p, temperature, chat_counter, chatbot, state],
-                 [chatbot, state, chat_counter], )
+        response_inputs = [system_msg, inputs, top_p, temperature, chat_counter, chatbot, state, repo_state,
+                           memory_state]
+        response_outputs = [chatbot, state, chat_counter, memory_state]
+        inputs.submit(generate_response, response_inputs, response_outputs, )
+        b1.click(generate_response, response_inputs, response_outputs, )
 
         inputs.submit(set_visible_false, [], [system_msg])
         b1.click(set_visible_false, [], [system_msg])
@@ -243,6 +260,8 @@ def main():
         b1.click(reset_textbox, [], [inputs])
         inputs.submit(reset_textbox, [], [inputs])
 
+    metrics.start_server()
+    repo_watcher.start(code_repo_path)
     demo.queue(max_size=99, concurrency_count=20).launch(debug=True)
 
 
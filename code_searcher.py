@@ -1,74 +1,85 @@
-import re
-import subprocess
+import os
+from repo_parser import load_symbol_index, load_call_graph
+import context_packer
 
+# Code_Searcher answers with the definition and its top callers instead of every raw textual match
+max_callers = int(os.environ.get("CODE_SEARCHER_MAX_CALLERS", 5))
+# Upper bound of one section, so a long definition (e.g. a large class) keeps its signature and the start
+# of its body instead of being dropped whole by the packer
+section_token_budget = int(os.environ.get("CODE_SEARCHER_SECTION_TOKENS", 768))
+# Counted with the tokenizer of the chat model the sections are packed for (see code_learner.model)
+token_model = "ggml-gpt4all-j" if os.environ.get('LLM_TYPE', "local") == "local" else "gpt-3.5-turbo"
 
-def extract_grep_output(line):
-    # Regular expressions to match the grep output lines
-    regex_colon = r'(.*):(\d+):(.*)'
-    regex_dash = r'(.*?)-(\d+)-(.*)'
-    match_colon = re.match(regex_colon, line)
-    match_dash = re.match(regex_dash, line)
 
-    if match_colon:
-        filename, line_number, line_content = match_colon.groups()
-        return [filename, line_number, line_content]
-    elif match_dash:
-        filename, line_number, line_content = match_dash.groups()
-        return [filename, line_number, line_content]
-    else:
-        return ["", "", line]
+def search_function_with_context(function_name, before_lines=5, after_lines=10, search_dir="./code_repo"):
+    # Looks the name up in the prebuilt symbol index instead of scanning the repo with grep
+    results = load_symbol_index(search_dir).search(function_name, before_lines, after_lines)
+    return [(result["filename"], f'{result["line"]}:{result["line_text"]}', result["context"]) for result in results]
 
 
-def search_function_with_context(function_name, before_lines=5, after_lines=10, search_dir="./code_repo"):
-    command = [
-        "grep",
-        "-r",  # Recursive search
-        "-n",  # Print line numbers
-        f"-B{before_lines}",  # Show context before the match
-        f"-A{after_lines}",  # Show context after the match
-        f"{function_name}",  # The search pattern
-        search_dir
-    ]
-
-    # Run the command and capture the output
-    result = subprocess.run(command, capture_output=True, text=True)
-
-    # Split the output by lines
-    output_lines = result.stdout.splitlines()
-
-    # Group the lines by occurrence
-    occurrences = []
-    current_filename = None
-    current_start_line = None
-    current_lines = []
-    for line in output_lines:
-        if line.startswith("--"):  # This line separates occurrences
-            if current_filename is not None:
-                occurrences.append((current_filename, current_start_line, "\n".join(current_lines)))
-            current_lines = []
+def get_raw_function_chunks(function_name, search_dir="./code_repo"):
+    results = search_function_with_context(function_name, search_dir=search_dir)
+    return [bound_section(f"Filename: {filename}\nStart line: {start_line}\nContext:\n", context.split("\n")) + "\n\n"
+            for filename, start_line, context in results]
+
+
+def bound_section(header, lines, budget=section_token_budget):
+    # header plus the leading lines that fit the budget; lines are never cut
+    if context_packer.count_tokens(header + "\n".join(lines), token_model) <= budget:
+        return header + "\n".join(lines)
+
+    def truncated(count):
+        return header + "\n".join(lines[:count]) + f"\n... ({len(lines) - count} more lines)"
+
+    low, high = min(1, len(lines)), len(lines)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if context_packer.count_tokens(truncated(middle), token_model) <= budget:
+            low = middle
         else:
-            current_filename, line_number, line_text = extract_grep_output(line)
-            if function_name in line_text:
-                current_start_line = line_number + ":" + line_text
-            current_lines.append(line_text)
+            high = middle - 1
+    # The first line (the signature) is always kept
+    return truncated(low)
 
-    # Add the last occurrence if there is one
-    if current_filename is not None:
-        occurrences.append((current_filename, current_start_line, "\n".join(current_lines)))
 
-    return occurrences
+def get_definition_sections(function_name, search_dir="./code_repo", caller_limit=max_callers):
+    # Sections in priority order: definitions first, then callers ranked by number of calls
+    call_graph = load_call_graph(search_dir)
+    definitions = call_graph.find_definitions(function_name)
+    if not definitions:
+        return []
+    symbol_index = load_symbol_index(search_dir)
 
+    sections = []
+    for definition in definitions:
+        lines = symbol_index.get_lines(definition["filename"])
+        section = f"Definition of {definition['qualname']}\n"
+        section += f"Filename: {definition['filename']}\n"
+        section += f"Lines: {definition['line']}-{definition['end_line']}\n"
+        callees = call_graph.find_callees(definition)
+        if callees:
+            section += f"Calls: {', '.join(callees)}\n"
+        section += "Context:\n"
+        sections.append(bound_section(section, lines[definition["line"] - 1:definition["end_line"]]))
 
-def get_function_context(function_name):
-    results = search_function_with_context(function_name)
-    output = ""
-    for filename, start_line, context in results:
-        output += f"Filename: {filename}\n"
-        output += f"Start line: {start_line}\n"
-        output += "Context:\n"
-        output += context
-        output += "\n\n"
-    return output
+    for caller in call_graph.find_callers(function_name, limit=caller_limit):
+        lines = symbol_index.get_lines(caller["filename"])
+        line = caller["lines"][0]
+        start, end = max(1, line - 3), min(len(lines), line + 3)
+        section = f"Called by {caller['caller']}\n"
+        section += f"Filename: {caller['filename']}\n"
+        section += f"Call lines: {', '.join(map(str, caller['lines']))}\n"
+        section += "Context:\n" + "\n".join(lines[start - 1:end])
+        sections.append(section)
+    return sections
+
+
+def get_function_context_chunks(function_name, search_dir="./code_repo"):
+    # Chunks in priority order for token-budgeted packing (see context_packer)
+    sections = get_definition_sections(function_name, search_dir)
+    if not sections:
+        return get_raw_function_chunks(function_name, search_dir)
+    return [section + "\n\n" for section in sections]
 
 
 if __name__ == "__main__":
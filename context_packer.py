@@ -0,0 +1,93 @@
+import os
+import threading
+from termcolor import colored
+import metrics
+
+# Packs the retrieved chunks into the tokens left in the model window, dropping whole chunks that do not fit
+default_model_windows = {
+    "ggml-gpt4all-j": 2048,
+    "gpt-3.5-turbo": 4096,
+    "gpt-3.5-turbo-16k": 16384,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+}
+default_window = 2048
+# Room left for the answer
+reserved_output_tokens = int(os.environ.get("CONTEXT_RESERVED_TOKENS", 512))
+# Chat format overhead per message and for priming the reply
+tokens_per_message = 4
+tokens_per_reply = 3
+
+
+def parse_model_windows(value):
+    # e.g. MODEL_CONTEXT_WINDOWS="ggml-gpt4all-j=2048,gpt-4=8192"
+    windows = {}
+    for item in value.split(","):
+        name, _, size = item.strip().partition("=")
+        if name and size:
+            windows[name.strip()] = int(size)
+    return windows
+
+
+model_windows = dict(default_model_windows, **parse_model_windows(os.environ.get("MODEL_CONTEXT_WINDOWS", "")))
+
+_encoders = {}
+_encoders_lock = threading.Lock()
+
+
+def get_encoder(model):
+    # tiktoken fetches its BPE files on first use; without them tokens are estimated as chars / 4
+    with _encoders_lock:
+        if model not in _encoders:
+            try:
+                import tiktoken
+                try:
+                    _encoders[model] = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    # Not an OpenAI model: GPT-J (gpt4all-j) uses the GPT-2 BPE, which also errs on the high side
+                    # for other local models, whereas cl100k_base would undercount code
+                    _encoders[model] = tiktoken.get_encoding("gpt2")
+            except Exception as e:
+                print(colored(f"tiktoken unavailable, estimating tokens from characters: {e}", "red"))
+                _encoders[model] = None
+        return _encoders[model]
+
+
+def count_tokens(text, model):
+    encoder = get_encoder(model)
+    if encoder is None:
+        return (len(text) + 3) // 4
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages, model):
+    return sum(tokens_per_message + count_tokens(message["content"], model) for message in messages) + tokens_per_reply
+
+
+def context_window(model):
+    return model_windows.get(model, default_window)
+
+
+def pack_chunks(chunks, budget, model):
+    # chunks are ordered by relevance; each one is kept if it still fits, otherwise dropped whole
+    packed, used = [], 0
+    for chunk in chunks:
+        tokens = count_tokens(chunk, model)
+        if used + tokens <= budget:
+            packed.append(chunk)
+            used += tokens
+    return packed, used
+
+
+def pack_prompt(messages, header, chunks, model):
+    # messages: everything sent before the final user message (system prompt and history).
+    # Returns the final user message content: the question header plus as many chunks as fit the window.
+    with metrics.span("prompt_assembly") as span:
+        prompt_tokens = count_message_tokens(messages, model) + tokens_per_message + count_tokens(header, model)
+        budget = context_window(model) - reserved_output_tokens - prompt_tokens
+        packed, used = pack_chunks(chunks, max(budget, 0), model)
+        content = header + "".join(packed)
+        span.update(chunks=len(packed), dropped=len(chunks) - len(packed), tokens=prompt_tokens + used,
+                    chars=len(content) + sum(len(message["content"]) for message in messages))
+    print(colored(f"Context packing: {len(packed)}/{len(chunks)} chunks, {used}/{max(budget, 0)} tokens", "blue"))
+    return content
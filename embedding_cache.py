@@ -0,0 +1,103 @@
+import os
+import hashlib
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from termcolor import colored
+
+# On-disk cache of chunk embeddings keyed by (model id, chunk text hash)
+embedding_cache_path = os.environ.get("EMBEDDING_CACHE_PATH", "./embedding_cache.sqlite")
+embedding_batch_size = int(os.environ.get("EMBEDDING_BATCH_SIZE", 64))
+
+SQLITE_MAX_PARAMS = 500
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, path=embedding_cache_path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings ("
+                           "model TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL, "
+                           "PRIMARY KEY (model, hash))")
+        self._conn.commit()
+
+    def get_many(self, model_id, hashes):
+        found = {}
+        with self._lock:
+            for start in range(0, len(hashes), SQLITE_MAX_PARAMS):
+                part = hashes[start:start + SQLITE_MAX_PARAMS]
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(part))})",
+                    [model_id, *part])
+                for digest, blob in rows:
+                    found[digest] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, model_id, items):
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                                   [(model_id, digest, np.asarray(vector, dtype=np.float32).tobytes())
+                                    for digest, vector in items])
+            self._conn.commit()
+
+
+class CachedEmbeddings(Embeddings):
+    # Wraps another Embeddings and only encodes chunks that are not cached yet.
+    # Misses are encoded in batches; with workers > 1 batches are sent concurrently (useful for remote APIs).
+    # batch_size=None passes all misses in one call, for models that batch and parallelize inside
+    # embed_documents (see LocalHuggingFaceEmbeddings).
+    def __init__(self, embedding, model_id, cache=None, batch_size=embedding_batch_size, workers=1):
+        self.embedding = embedding
+        self.model_id = model_id
+        self.cache = cache if cache is not None else EmbeddingCache()
+        self.batch_size = batch_size
+        self.workers = workers
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts):
+        hashes = [text_hash(text) for text in texts]
+        vectors = self.cache.get_many(self.model_id, list(set(hashes)))
+
+        missing = {}
+        for digest, text in zip(hashes, texts):
+            if digest not in vectors:
+                missing.setdefault(digest, text)
+        self.hits += len(texts) - sum(1 for digest in hashes if digest in missing)
+        self.misses += len(missing)
+        if missing:
+            print(colored(f"Embedding {len(missing)} new chunks ({len(texts) - len(missing)} cached)...", "green"))
+            vectors.update(self._encode_missing(list(missing.items())))
+
+        return np.stack([vectors[digest] for digest in hashes]) if texts else []
+
+    def _encode_missing(self, items):
+        batch_size = self.batch_size or len(items)
+        batches = [items[start:start + batch_size] for start in range(0, len(items), batch_size)]
+
+        def encode(batch):
+            batch_vectors = np.asarray(self.embedding.embed_documents([text for _, text in batch]), dtype=np.float32)
+            result = [(digest, vector) for (digest, _), vector in zip(batch, batch_vectors)]
+            self.cache.put_many(self.model_id, result)
+            return result
+
+        encoded = {}
+        if self.workers > 1 and len(batches) > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for result in executor.map(encode, batches):
+                    encoded.update(result)
+        else:
+            for batch in batches:
+                encoded.update(encode(batch))
+        return encoded
+
+    def embed_query(self, text):
+        return self.embedding.embed_query(text)
@@ -0,0 +1,181 @@
+import os
+import time
+import uuid
+import threading
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from termcolor import colored
+from repo_parser import repo_checkout_folder, fork_checkout_folder, same_repo_url, sync_repo, describe_repo, \
+    is_repo_folder, get_vdb_path, read_vdb_header, generate_or_load_knowledge_from_repo, \
+    generate_or_load_symbol_index, generate_or_load_call_graph
+
+# Background repo analysis jobs; a repo that is already being analyzed joins its running job
+index_job_workers = int(os.environ.get("INDEX_JOB_WORKERS", 2))
+# Finished jobs kept for status queries
+max_finished_jobs = 100
+
+_executor = ThreadPoolExecutor(max_workers=index_job_workers)
+_lock = threading.Lock()
+_jobs = OrderedDict()  # job id -> IndexJob
+_active = {}  # repo folder -> IndexJob that is queued or running
+_repo_locks = {}
+
+
+class IndexJob:
+    def __init__(self, repo_url, repo_folder):
+        self.id = uuid.uuid4().hex[:12]
+        self.repo_url = repo_url
+        self.repo_folder = repo_folder
+        self.state = "queued"  # queued, running, completed, failed
+        self.stage = "Queued"
+        self.files_done = 0
+        self.files_total = 0
+        self.chunks_done = 0
+        self.changed = None
+        self.repo_information = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.done = threading.Event()
+        # (vdb, lock) of a store built from scratch, while it is being built
+        self._partial = None
+
+    def progress(self, files_done, files_total, chunks_done):
+        self.files_done, self.files_total, self.chunks_done = files_done, files_total, chunks_done
+
+    def publish(self, vdb, lock):
+        self._partial = (vdb, lock)
+
+    def search_partial(self, fn):
+        # fn(vdb) on the store being built, or None if there is none (e.g. an update keeps the saved store)
+        partial = self._partial
+        if partial is None:
+            return None
+        vdb, lock = partial
+        with lock:
+            return fn(vdb)
+
+    def queryable(self):
+        # A fresh build is queryable once its store is published (the symbol index is built before it);
+        # an update answers from the indexes saved by the previous analysis meanwhile
+        if self._partial is not None or self.done.is_set():
+            return True
+        if not is_repo_folder(self.repo_folder):
+            return False
+        vdb_path = get_vdb_path(self.repo_folder)
+        return read_vdb_header(vdb_path) is not None and os.path.isfile(os.path.join(vdb_path, "symbols.json"))
+
+    def status(self):
+        if self.state == "completed":
+            return "Analysis completed"
+        if self.state == "failed":
+            return f"Analysis failed: {self.error}"
+        if self.stage == "Embedding" and self.files_total:
+            partial = ", questions use the part indexed so far" if self._partial is not None else ""
+            return f"Embedding: {self.files_done}/{self.files_total} files, {self.chunks_done} chunks{partial}"
+        return self.stage + "..."
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "repo_url": self.repo_url,
+            "repo_folder": self.repo_folder,
+            "state": self.state,
+            "stage": self.stage,
+            "status": self.status(),
+            "files_done": self.files_done,
+            "files_total": self.files_total,
+            "chunks_done": self.chunks_done,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+def submit(repo_url, code_repo_path="./code_repo"):
+    # Returns the job analyzing repo_url, starting one unless the repo already has a queued or running job
+    repo_url = repo_url.strip()
+    # Resolving the folder may run git, so it is done before taking the lock; the active jobs are checked under it
+    repo_folder = repo_checkout_folder(repo_url, code_repo_path)
+    with _lock:
+        job = _active.get(repo_folder)
+        if job is not None:
+            if same_repo_url(job.repo_url, repo_url):
+                print(colored(f"Joining indexing job {job.id} for {repo_url}", "green"))
+                return job
+            # Another repo with the same name is being cloned into that folder
+            repo_folder = fork_checkout_folder(repo_url, code_repo_path)
+            job = _active.get(repo_folder)
+            if job is not None:
+                return job
+        job = IndexJob(repo_url, repo_folder)
+        _jobs[job.id] = job
+        _active[repo_folder] = job
+        _prune()
+    _executor.submit(_run, job, code_repo_path)
+    return job
+
+
+def repo_lock(repo_folder):
+    # Serializes the index updates of a repo (analysis jobs, watch mode)
+    with _lock:
+        if repo_folder not in _repo_locks:
+            _repo_locks[repo_folder] = threading.Lock()
+        return _repo_locks[repo_folder]
+
+
+def get_job(job_id):
+    with _lock:
+        return _jobs.get(job_id)
+
+
+def active_job(repo_folder):
+    # The queued or running job of a checkout folder, if any
+    with _lock:
+        return _active.get(repo_folder)
+
+
+def list_jobs():
+    with _lock:
+        return [job.to_dict() for job in _jobs.values()]
+
+
+def _prune():
+    finished = [job_id for job_id, job in _jobs.items() if job.done.is_set()]
+    for job_id in finished[:max(0, len(finished) - max_finished_jobs)]:
+        del _jobs[job_id]
+
+
+def _run(job, code_repo_path):
+    job.state, job.started = "running", time.time()
+    try:
+        with repo_lock(job.repo_folder):
+            job.stage = "Cloning"
+            os.makedirs(code_repo_path, exist_ok=True)
+            _, job.changed = sync_repo(job.repo_url, code_repo_path, job.repo_folder)
+            # Symbols first: they are quick to build and let Code_Searcher answer while the embeddings run
+            job.stage = "Indexing symbols"
+            generate_or_load_symbol_index(job.repo_folder)
+            generate_or_load_call_graph(job.repo_folder)
+            job.stage = "Embedding"
+            generate_or_load_knowledge_from_repo(job.repo_folder, progress=job.progress, publish=job.publish)
+        job.stage = "Summarizing the repo"
+        job.repo_information = describe_repo(job.repo_folder)
+        job.state = "completed"
+    except subprocess.CalledProcessError as e:
+        job.state, job.error = "failed", (e.stderr or str(e)).strip()
+    except Exception as e:
+        job.state, job.error = "failed", f"{type(e).__name__}: {e}"
+    finally:
+        job.finished = time.time()
+        if job.state == "failed":
+            print(colored(f"Indexing job {job.id} for {job.repo_url} failed: {job.error}", "red"))
+        with _lock:
+            if _active.get(job.repo_folder) is job:
+                del _active[job.repo_folder]
+            # The saved store serves questions from now on
+            job._partial = None
+        job.done.set()
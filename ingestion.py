@@ -0,0 +1,103 @@
+import os
+import queue
+import threading
+import multiprocessing
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+from termcolor import colored
+from knowledge_base import load_documents, add_embeddings_to_vdb
+
+# Streaming ingestion: process pool load/split -> bounded queue -> batched embedding -> index add
+ingest_workers = int(os.environ.get("INGEST_WORKERS", os.cpu_count() or 1))
+ingest_queue_size = int(os.environ.get("INGEST_QUEUE_SIZE", 64))
+ingest_batch_size = int(os.environ.get("INGEST_BATCH_SIZE", 256))
+# Smaller change sets (e.g. watch mode refreshes) are split in the calling thread: starting the workers,
+# which import langchain, takes seconds, while splitting a file takes milliseconds
+ingest_pool_min_files = int(os.environ.get("INGEST_POOL_MIN_FILES", 1000))
+
+_DONE = object()
+
+
+def load_file_documents(filepath):
+    try:
+        # Using a more general way for code file parsing
+        return filepath, load_documents([filepath])
+    except Exception as e:
+        print(f"Failed to process {filepath} due to error: {str(e)}")
+        return filepath, []
+
+
+def _split_files(filepaths, out_queue, workers, errors):
+    try:
+        if workers <= 1 or len(filepaths) < ingest_pool_min_files:
+            for filepath in filepaths:
+                out_queue.put(load_file_documents(filepath))
+            return
+        # Spawned rather than forked: the app is full of threads (Gradio, retrieval pools, watchers) whose
+        # locks a forked child could inherit in the locked state
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            pending = set()
+            for filepath in filepaths:
+                # Backpressure: don't submit more files while enough are in flight
+                while len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        out_queue.put(future.result())
+                pending.add(executor.submit(load_file_documents, filepath))
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    out_queue.put(future.result())
+    except Exception as e:
+        errors.append(e)
+    finally:
+        out_queue.put(_DONE)
+
+
+def ingest_files(filepaths, vdb, embedding, workers=ingest_workers, queue_size=ingest_queue_size,
+                 batch_size=ingest_batch_size, progress=None, lock=None):
+    # Adds the chunks of `filepaths` to `vdb` and returns {filepath: [chunk ids]}.
+    # progress(files_done, files_total, chunks_done) is called after every embedded batch.
+    # lock, if given, is held while a batch is added, so `vdb` can be searched while it is built.
+    file_ids = {filepath: [] for filepath in filepaths}
+    out_queue = queue.Queue(maxsize=queue_size)
+    errors = []
+    splitter = threading.Thread(target=_split_files, args=(filepaths, out_queue, workers, errors), daemon=True)
+    splitter.start()
+
+    batch_docs, batch_files = [], []
+    files_done, chunks_done = 0, 0
+
+    def flush():
+        nonlocal chunks_done
+        if batch_docs:
+            vectors = np.asarray(embedding.embed_documents([doc.page_content for doc in batch_docs]),
+                                 dtype=np.float32)
+            with lock or nullcontext():
+                ids = add_embeddings_to_vdb(vdb, batch_docs, vectors)
+            for filepath, doc_id in zip(batch_files, ids):
+                file_ids[filepath].append(doc_id)
+            chunks_done += len(ids)
+            batch_docs.clear()
+            batch_files.clear()
+        if progress is not None:
+            progress(files_done, len(filepaths), chunks_done)
+
+    while True:
+        item = out_queue.get()
+        if item is _DONE:
+            break
+        filepath, docs = item
+        batch_docs.extend(docs)
+        batch_files.extend([filepath] * len(docs))
+        files_done += 1
+        if len(batch_docs) >= batch_size:
+            flush()
+    flush()
+    splitter.join()
+    if errors:
+        raise errors[0]
+
+    print(colored(f"Ingested {files_done} files into {chunks_done} chunks", "green"))
+    return file_ids
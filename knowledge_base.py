@@ -9,19 +9,41 @@ from langchain.document_loaders import TextLoader, PyPDFLoader
 import requests
 from bs4 import BeautifulSoup
 import pickle
+import json
+import re
+import mmap
+import uuid
+import weakref
+import numpy as np
+import faiss
 from langchain import OpenAI
 from langchain.chains import VectorDBQAWithSourcesChain
 from langchain.embeddings.base import Embeddings
+from langchain.docstore.base import Docstore
+from langchain.docstore.document import Document
+from langchain.docstore.in_memory import InMemoryDocstore
 from sentence_transformers import SentenceTransformer
 from termcolor import colored
+import registry
+import ann_index
+from embedding_cache import CachedEmbeddings, embedding_batch_size
 
 
 class LocalHuggingFaceEmbeddings(Embeddings):
-    def __init__(self, model_id="all-mpnet-base-v2"):
+    def __init__(self, model_id="all-mpnet-base-v2", batch_size=None, workers=None):
+        self.model_id = model_id
         self.model = SentenceTransformer(model_id)
+        self.batch_size = batch_size or embedding_batch_size
+        # EMBEDDING_WORKERS > 1 encodes large inputs in a pool of CPU worker processes
+        self.workers = workers or int(os.environ.get("EMBEDDING_WORKERS", 1))
+        self._pool = None
 
     def embed_documents(self, texts):
-        embeddings = self.model.encode(texts)
+        if self.workers > 1 and len(texts) >= self.batch_size * self.workers:
+            if self._pool is None:
+                self._pool = self.model.start_multi_process_pool(target_devices=["cpu"] * self.workers)
+            return self.model.encode_multi_process(texts, self._pool, batch_size=self.batch_size)
+        embeddings = self.model.encode(texts, batch_size=self.batch_size)
         return embeddings
 
     def embed_query(self, text):
@@ -29,12 +51,17 @@ class LocalHuggingFaceEmbeddings(Embeddings):
         return list(map(float, embedding))
 
 
+# The splitter is stateless, so one instance is shared instead of building one per file
+text_splitter = RecursiveCharacterTextSplitter(
+    chunk_size=1500,
+    chunk_overlap=200,
+    length_function=len,
+    # Lets retrieval merge neighbouring chunks of the same file
+    add_start_index=True,
+)
+
+
 def load_documents(filenames):
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1500,
-        chunk_overlap=200,
-        length_function=len,
-    )
     docs = []
     for filename in filenames:
         if filename.endswith(".pdf"):
@@ -76,28 +103,250 @@ def load_code_chunks(chunks, filepath):
     return docs, metadatas
 
 
-def local_vdb(knowledge, vdb_path=None):
+def get_embedding():
+    # The embedding model is loaded once per process and shared by all sessions.
+    # Both backends go through the on-disk chunk embedding cache.
     embedding_type = os.environ.get('EMBEDDING_TYPE', "local")
     if embedding_type == "local":
-        embedding = LocalHuggingFaceEmbeddings()
+        return registry.get_singleton("embedding:local", local_cached_embedding)
     else:
-        embedding = OpenAIEmbeddings(disallowed_special=())
+        return registry.get_singleton("embedding:openai", openai_cached_embedding)
+
+
+def local_cached_embedding():
+    embedding = LocalHuggingFaceEmbeddings()
+    # The model batches by itself, and with EMBEDDING_WORKERS > 1 needs all misses at once to use its pool
+    return CachedEmbeddings(embedding, "local:" + embedding.model_id, batch_size=None)
+
+
+def openai_cached_embedding():
+    embedding = OpenAIEmbeddings(disallowed_special=())
+    concurrency = int(os.environ.get("OPENAI_EMBEDDING_CONCURRENCY", 4))
+    return CachedEmbeddings(embedding, "openai:" + embedding.model, batch_size=embedding.chunk_size,
+                            workers=concurrency)
+
+
+def local_vdb(knowledge, vdb_path=None):
+    embedding = get_embedding()
     print(colored("Embedding documents...", "green"))
     faiss_store = FAISS.from_documents(knowledge["known_docs"], embedding=embedding)
+    ann_index.maybe_upgrade(faiss_store)
     if vdb_path is not None:
-        with open(vdb_path, "wb") as f:
-            pickle.dump(faiss_store, f)
+        save_local_vdb(faiss_store, vdb_path)
 
     return faiss_store
 
 
-def load_local_vdb(vdb_path):
-    with open(vdb_path, "rb") as f:
+VDB_FORMAT_VERSION = 1
+GENERATION_FILE_RE = re.compile(r"(?:index|docstore|offsets|ids|labels)-(\d+)\.")
+
+
+class MmapDocstore(Docstore):
+    # Read-only docstore backed by a memory-mapped JSON-lines file, so worker processes share the pages
+    def __init__(self, docstore_path, offsets_path, ids):
+        # The mapping keeps its own handle to the file; it is unmapped by close() or once the store is collected,
+        # e.g. after the registry evicted it and the last query using it finished
+        with open(docstore_path, "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(docstore_path) else b""
+        self._offsets = np.load(offsets_path, mmap_mode="r")
+        self._rows = {doc_id: row for row, doc_id in enumerate(ids)}
+        self._finalizer = weakref.finalize(self, _close_mapping, self._data)
+
+    def close(self):
+        self._finalizer()
+
+    def search(self, search):
+        row = self._rows.get(search)
+        if row is None:
+            return f"ID {search} not found."
+        record = json.loads(self._data[int(self._offsets[row]):int(self._offsets[row + 1])])
+        return Document(page_content=record["page_content"], metadata=record["metadata"])
+
+    def __len__(self):
+        return len(self._rows)
+
+
+def _close_mapping(data):
+    if isinstance(data, mmap.mmap):
+        data.close()
+
+
+def read_vdb_header(vdb_path):
+    header_path = os.path.join(vdb_path, "header.json")
+    if not os.path.isfile(header_path):
+        return None
+    with open(header_path, "r") as f:
+        header = json.load(f)
+    if header.get("format_version") != VDB_FORMAT_VERSION:
+        return None
+    return header
+
+
+def save_local_vdb(faiss_store, vdb_path):
+    # Layout: header.json + native FAISS index + JSON-lines docstore with a row offset table + ids.
+    # Data files are written under a new generation suffix and header.json is replaced last,
+    # so readers never see a partial store. The previous generation is kept until the next save,
+    # for readers that read its header just before it was replaced.
+    os.makedirs(vdb_path, exist_ok=True)
+    old_header = read_vdb_header(vdb_path)
+    generation = old_header["generation"] + 1 if old_header is not None else 0
+    files = {
+        "index": f"index-{generation}.faiss",
+        "docstore": f"docstore-{generation}.jsonl",
+        "offsets": f"offsets-{generation}.npy",
+        "ids": f"ids-{generation}.txt",
+    }
+    positional = ann_index.is_positional(faiss_store.index)
+    if not positional:
+        # Index labels of ANN indexes are not positions, so they are stored with the ids
+        files["labels"] = f"labels-{generation}.npy"
+
+    positions = sorted(faiss_store.index_to_docstore_id)
+    ids = [faiss_store.index_to_docstore_id[pos] for pos in positions]
+    offsets = [0]
+    with open(os.path.join(vdb_path, files["docstore"]), "wb") as f:
+        for doc_id in ids:
+            doc = faiss_store.docstore.search(doc_id)
+            line = json.dumps({"page_content": doc.page_content, "metadata": doc.metadata}).encode("utf-8") + b"\n"
+            f.write(line)
+            offsets.append(offsets[-1] + len(line))
+    np.save(os.path.join(vdb_path, files["offsets"]), np.array(offsets, dtype=np.int64))
+    with open(os.path.join(vdb_path, files["ids"]), "w") as f:
+        f.write("\n".join(ids))
+    if not positional:
+        np.save(os.path.join(vdb_path, files["labels"]), np.array(positions, dtype=np.int64))
+    faiss.write_index(faiss_store.index, os.path.join(vdb_path, files["index"]))
+
+    header = {
+        "format_version": VDB_FORMAT_VERSION,
+        "generation": generation,
+        "dim": faiss_store.index.d,
+        "count": len(ids),
+        "index_type": type(ann_index.base_index(faiss_store.index)).__name__,
+        "files": files,
+    }
+    tmp_path = os.path.join(vdb_path, "header.json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(header, f, indent=2)
+    os.replace(tmp_path, os.path.join(vdb_path, "header.json"))
+
+    # Older generations, including the files of interrupted saves
+    for name in os.listdir(vdb_path):
+        match = GENERATION_FILE_RE.match(name)
+        if match is not None and int(match.group(1)) < generation - 1:
+            try:
+                os.remove(os.path.join(vdb_path, name))
+            except OSError:
+                pass
+
+
+def read_faiss_index(index_path, use_mmap=True):
+    if use_mmap:
+        # Older FAISS builds can only map some index types; fall back to a regular read for the rest
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+        try:
+            return faiss.read_index(index_path, flags)
+        except RuntimeError:
+            pass
+    return faiss.read_index(index_path)
+
+
+def load_local_vdb(vdb_path, embedding=None, use_mmap=True):
+    # use_mmap=False loads a fully in-memory, mutable store (needed for incremental updates)
+    header = read_vdb_header(vdb_path)
+    if header is None:
+        raise FileNotFoundError(f"No VDB (format version {VDB_FORMAT_VERSION}) found at {vdb_path}")
+    files = {key: os.path.join(vdb_path, name) for key, name in header["files"].items()}
+    if embedding is None:
+        embedding = get_embedding()
+
+    with open(files["ids"], "r") as f:
+        ids = f.read().split("\n") if header["count"] else []
+    index = ann_index.apply_search_defaults(read_faiss_index(files["index"], use_mmap))
+    labels = np.load(files["labels"]).tolist() if "labels" in files else range(len(ids))
+    if use_mmap:
+        docstore = MmapDocstore(files["docstore"], files["offsets"], ids)
+    else:
+        docs = {}
+        with open(files["docstore"], "rb") as f:
+            for doc_id, line in zip(ids, f):
+                record = json.loads(line)
+                docs[doc_id] = Document(page_content=record["page_content"], metadata=record["metadata"])
+        docstore = InMemoryDocstore(docs)
+    return FAISS(embedding.embed_query, index, docstore, dict(zip(labels, ids)))
+
+
+def estimate_vdb_bytes(faiss_store):
+    # Vector storage plus a rough per-chunk allowance for the id maps and docstore
+    return ann_index.index_bytes(faiss_store.index) + faiss_store.index.ntotal * 256
+
+
+def load_pickled_vdb(pkl_path):
+    with open(pkl_path, "rb") as f:
         faiss_store = pickle.load(f)
 
     return faiss_store
 
 
+def convert_pickled_vdb(pkl_path, vdb_path):
+    # Converts a store written by the old pickle-based local_vdb into the on-disk format
+    print(colored(f"Converting {pkl_path} to {vdb_path}...", "green"))
+    save_local_vdb(load_pickled_vdb(pkl_path), vdb_path)
+
+
+def empty_vdb(embedding, dim=None):
+    if dim is None:
+        dim = len(embedding.embed_query("dimension probe"))
+    return FAISS(embedding.embed_query, faiss.IndexFlatL2(dim), InMemoryDocstore({}), {})
+
+
+def add_documents_to_vdb(faiss_store, docs, embedding):
+    # Embed the whole batch at once instead of FAISS.add_texts, which embeds one text at a time
+    if not docs:
+        return []
+    vectors = np.asarray(embedding.embed_documents([doc.page_content for doc in docs]), dtype=np.float32)
+    return add_embeddings_to_vdb(faiss_store, docs, vectors)
+
+
+def add_embeddings_to_vdb(faiss_store, docs, vectors):
+    ids = [str(uuid.uuid4()) for _ in docs]
+    if ann_index.is_positional(faiss_store.index):
+        start = faiss_store.index.ntotal
+        faiss_store.index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+    else:
+        start = ann_index.next_label(faiss_store)
+        ann_index.add_vectors(faiss_store.index, vectors, range(start, start + len(ids)))
+    faiss_store.docstore.add(dict(zip(ids, docs)))
+    for offset, doc_id in enumerate(ids):
+        faiss_store.index_to_docstore_id[start + offset] = doc_id
+    return ids
+
+
+def remove_documents_from_vdb(faiss_store, ids):
+    ids = set(ids)
+    positions = [pos for pos, doc_id in faiss_store.index_to_docstore_id.items() if doc_id in ids]
+    if not positions:
+        return 0
+    if not ann_index.is_positional(faiss_store.index):
+        # Labels of ANN indexes are stable
+        ann_index.remove_labels(faiss_store.index, positions)
+        for pos in positions:
+            del faiss_store.index_to_docstore_id[pos]
+        for doc_id in ids:
+            faiss_store.docstore._dict.pop(doc_id, None)
+        return len(positions)
+    faiss_store.index.remove_ids(np.array(positions, dtype=np.int64))
+
+    # A flat index compacts the remaining vectors, so the position -> docstore id mapping is renumbered
+    remaining = [faiss_store.index_to_docstore_id[pos] for pos in sorted(faiss_store.index_to_docstore_id)
+                 if faiss_store.index_to_docstore_id[pos] not in ids]
+    faiss_store.index_to_docstore_id.clear()
+    faiss_store.index_to_docstore_id.update(enumerate(remaining))
+    for doc_id in ids:
+        faiss_store.docstore._dict.pop(doc_id, None)
+    return len(positions)
+
+
 def supabase_vdb(knowledge):
     supabase_url = os.environ.get("SUPABASE_URL")
     supabase_key = os.environ.get("SUPABASE_KEY")
@@ -0,0 +1,107 @@
+import os
+import re
+import json
+import math
+import heapq
+
+# BM25 index over the same chunks as the VDB, keyed by docstore id. It is persisted next to the VDB
+# (lexical.json) and updated together with it; `generation` records the VDB generation it matches.
+LEXICAL_INDEX_VERSION = 1
+k1 = 1.2
+b = 0.75
+
+WORD_RE = re.compile(r"[A-Za-z0-9_]+")
+CAMEL_RE = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+")
+STOP_WORDS = {"a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how", "i", "in",
+              "is", "it", "of", "on", "or", "the", "this", "to", "what", "when", "where", "which", "who", "why",
+              "with", "use", "used", "repo", "code", "function", "defined", "define", "definition"}
+
+
+def tokenize(text):
+    # Identifiers are indexed whole and by their snake_case / camelCase parts
+    tokens = []
+    for word in WORD_RE.findall(text):
+        lowered = word.lower()
+        tokens.append(lowered)
+        parts = [part.lower() for piece in word.split("_") for part in CAMEL_RE.findall(piece)]
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+def query_terms(text):
+    return [token for token in dict.fromkeys(tokenize(text)) if token not in STOP_WORDS]
+
+
+class BM25Index:
+    def __init__(self, docs=None, generation=None):
+        # docs: docstore id -> {"length": token count, "terms": {token: term frequency}}
+        self.docs = docs or {}
+        self.generation = generation
+        self.postings = {}
+        self.total_length = 0
+        for doc_id, entry in self.docs.items():
+            self._add_postings(doc_id, entry)
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.isfile(path):
+            return None
+        with open(path, "r") as f:
+            data = json.load(f)
+        if data.get("version") != LEXICAL_INDEX_VERSION:
+            return None
+        return cls(data["docs"], data.get("generation"))
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": LEXICAL_INDEX_VERSION, "generation": self.generation, "docs": self.docs}, f)
+        os.replace(tmp_path, path)
+
+    def _add_postings(self, doc_id, entry):
+        for token, frequency in entry["terms"].items():
+            self.postings.setdefault(token, {})[doc_id] = frequency
+        self.total_length += entry["length"]
+
+    def add(self, texts):
+        # texts: docstore id -> chunk text
+        for doc_id, text in texts.items():
+            self.remove([doc_id])
+            tokens = tokenize(text)
+            terms = {}
+            for token in tokens:
+                terms[token] = terms.get(token, 0) + 1
+            self.docs[doc_id] = {"length": len(tokens), "terms": terms}
+            self._add_postings(doc_id, self.docs[doc_id])
+
+    def remove(self, ids):
+        for doc_id in ids:
+            entry = self.docs.pop(doc_id, None)
+            if entry is None:
+                continue
+            for token in entry["terms"]:
+                doc_postings = self.postings.get(token)
+                if doc_postings is not None:
+                    doc_postings.pop(doc_id, None)
+                    if not doc_postings:
+                        del self.postings[token]
+            self.total_length -= entry["length"]
+
+    def search(self, query, k=20):
+        # Returns [(doc_id, score)] sorted by descending BM25 score
+        count = len(self.docs)
+        if not count:
+            return []
+        average_length = self.total_length / count
+        scores = {}
+        for token in query_terms(query):
+            doc_postings = self.postings.get(token)
+            if not doc_postings:
+                continue
+            idf = math.log(1 + (count - len(doc_postings) + 0.5) / (len(doc_postings) + 0.5))
+            for doc_id, frequency in doc_postings.items():
+                length = self.docs[doc_id]["length"]
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (k1 + 1) / (
+                    frequency + k1 * (1 - b + b * length / average_length))
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
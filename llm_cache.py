@@ -0,0 +1,120 @@
+import os
+import time
+import json
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+from termcolor import colored
+from knowledge_base import get_embedding
+
+# On-disk cache of LLM responses in front of util.get_chat_response, with optional semantic matching
+cache_enabled = os.environ.get("LLM_CACHE", "1") == "1"
+cache_path = os.environ.get("LLM_CACHE_PATH", "./llm_cache.sqlite")
+cache_ttl = float(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 3600))
+cache_max_entries = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 10000))
+# Unset disables semantic matching
+semantic_threshold = float(os.environ["LLM_CACHE_SEMANTIC_THRESHOLD"]) \
+    if os.environ.get("LLM_CACHE_SEMANTIC_THRESHOLD") else None
+
+_lock = threading.Lock()
+_conn = None
+_stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0}
+
+
+def _connection():
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(cache_path, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("CREATE TABLE IF NOT EXISTS responses ("
+                      "key TEXT PRIMARY KEY, namespace TEXT, embedding BLOB, response TEXT, "
+                      "created REAL, accessed REAL)")
+        _conn.execute("CREATE INDEX IF NOT EXISTS responses_namespace ON responses (namespace)")
+        _conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        _conn.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses (created)")
+        _conn.commit()
+    return _conn
+
+
+def _hash(*parts):
+    return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+
+def cache_keys(model, temperature, system_prompt, user_prompt, semantic_key=None):
+    key = _hash(model, temperature, system_prompt, user_prompt)
+    namespace = None
+    if semantic_key:
+        # Entries are only semantically comparable when everything except the semantic key is identical
+        namespace = _hash(model, temperature, system_prompt, user_prompt.replace(semantic_key, "\0"))
+    return key, namespace
+
+
+def _embed(text):
+    vector = np.asarray(get_embedding().embed_query(text), dtype=np.float32)
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+
+def lookup(model, temperature, system_prompt, user_prompt, semantic_key=None):
+    if not cache_enabled:
+        return None
+    key, namespace = cache_keys(model, temperature, system_prompt, user_prompt, semantic_key)
+    now = time.time()
+    # Expired entries are skipped here and deleted by store(), so a miss does not write
+    with _lock:
+        conn = _connection()
+        row = conn.execute("SELECT response FROM responses WHERE key = ? AND created >= ?",
+                           (key, now - cache_ttl)).fetchone()
+        if row is not None:
+            conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            conn.commit()
+            _stats["exact_hits"] += 1
+            return row[0]
+
+    if namespace is not None and semantic_threshold is not None:
+        query = _embed(semantic_key)
+        with _lock:
+            rows = _connection().execute("SELECT key, embedding, response FROM responses "
+                                         "WHERE namespace = ? AND embedding IS NOT NULL AND created >= ?",
+                                         (namespace, now - cache_ttl)).fetchall()
+        if rows:
+            similarities = np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows]) @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] >= semantic_threshold:
+                with _lock:
+                    _connection().execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, rows[best][0]))
+                    _connection().commit()
+                    _stats["semantic_hits"] += 1
+                print(colored(f"LLM cache semantic hit (similarity {similarities[best]:.3f})", "green"))
+                return rows[best][2]
+
+    with _lock:
+        _stats["misses"] += 1
+    return None
+
+
+def store(model, temperature, system_prompt, user_prompt, response, semantic_key=None):
+    if not cache_enabled or response is None:
+        return
+    key, namespace = cache_keys(model, temperature, system_prompt, user_prompt, semantic_key)
+    embedding = None
+    if namespace is not None and semantic_threshold is not None:
+        embedding = _embed(semantic_key).tobytes()
+    now = time.time()
+    with _lock:
+        conn = _connection()
+        conn.execute("INSERT OR REPLACE INTO responses (key, namespace, embedding, response, created, accessed) "
+                     "VALUES (?, ?, ?, ?, ?, ?)", (key, namespace, embedding, response, now, now))
+        conn.execute("DELETE FROM responses WHERE created < ?", (now - cache_ttl,))
+        # Least recently used entries beyond the cap are evicted
+        conn.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+                     "ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (cache_max_entries,))
+        conn.commit()
+
+
+def cache_stats():
+    with _lock:
+        stats = dict(_stats)
+    total = stats["exact_hits"] + stats["semantic_hits"] + stats["misses"]
+    stats["hit_rate"] = (stats["exact_hits"] + stats["semantic_hits"]) / total if total else 0.0
+    return stats
@@ -0,0 +1,158 @@
+import os
+import asyncio
+import threading
+from contextlib import contextmanager
+import requests
+import httpx
+import openai
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from langchain.llms import OpenAI
+from langchain.chat_models import ChatOpenAI
+import registry
+
+# Shared HTTP clients for the LLM backends: connection pools, timeouts, retries and concurrency limits
+pool_size = int(os.environ.get("LLM_POOL_SIZE", 20))
+max_concurrency = int(os.environ.get("LLM_MAX_CONCURRENCY", 20))
+connect_timeout = float(os.environ.get("LLM_CONNECT_TIMEOUT", 10))
+read_timeout = float(os.environ.get("LLM_READ_TIMEOUT", 300))
+max_retries = int(os.environ.get("LLM_MAX_RETRIES", 3))
+retry_backoff = float(os.environ.get("LLM_RETRY_BACKOFF", 0.5))
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_semaphores = {}
+_semaphores_lock = threading.Lock()
+
+
+def llm_backend():
+    return "local" if os.environ.get('LLM_TYPE', "local") == "local" else "openai"
+
+
+def api_base(backend):
+    if backend == "local":
+        return os.environ.get('OPENAI_API_BASE', 'http://localhost:8080/v1')
+    return os.environ.get('OPENAI_API_BASE', 'https://api.openai.com/v1')
+
+
+def api_headers(backend):
+    api_key = os.environ.get("OPENAI_API_KEY", "null") if backend == "openai" else "null"
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}"
+    }
+
+
+def timeouts():
+    return connect_timeout, read_timeout
+
+
+def create_session():
+    # The only retry layer of the sync clients: langchain's own retries are disabled below
+    retry = Retry(total=max_retries, connect=max_retries, read=0, status=max_retries,
+                  backoff_factor=retry_backoff, status_forcelist=RETRY_STATUSES,
+                  allowed_methods=None, raise_on_status=False, respect_retry_after_header=True)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session(backend):
+    return registry.get_singleton(f"llm_session:{backend}", create_session)
+
+
+def install_openai_session():
+    # A factory rather than a shared session: the openai library keeps one session per thread and closes it
+    # every few minutes, which would close the pool the chat stream uses
+    openai.requestssession = create_session
+
+
+@contextmanager
+def limit(backend):
+    with _semaphores_lock:
+        if backend not in _semaphores:
+            _semaphores[backend] = threading.BoundedSemaphore(max_concurrency)
+        semaphore = _semaphores[backend]
+    with semaphore:
+        yield
+
+
+def get_completion_llm(model_name, temperature):
+    install_openai_session()
+    base_path = api_base("local")
+    return registry.get_singleton(
+        f"llm:completion:{base_path}:{model_name}:{temperature}",
+        lambda: OpenAI(temperature=temperature, openai_api_base=base_path, model_name=model_name,
+                       openai_api_key="null", request_timeout=read_timeout, max_retries=0))
+
+
+def get_chat_llm(model_name, temperature):
+    install_openai_session()
+    return registry.get_singleton(
+        f"llm:chat:{model_name}:{temperature}",
+        lambda: ChatOpenAI(model_name=model_name, temperature=temperature, request_timeout=read_timeout,
+                           max_retries=0))
+
+
+def stream_chat_completion(payload, backend=None):
+    # Yields the raw SSE lines of a streaming chat completion.
+    # The backend's concurrency slot is held until the stream is consumed or closed.
+    backend = backend or llm_backend()
+    with limit(backend):
+        response = get_session(backend).post(api_base(backend) + "/chat/completions", headers=api_headers(backend),
+                                             json=payload, stream=True, timeout=timeouts())
+        try:
+            for line in response.iter_lines():
+                yield line
+        finally:
+            response.close()
+
+
+class AsyncLLMClient:
+    # Async variant of the streaming path. httpx clients are bound to the event loop they are used from, so the
+    # pool belongs to its owner: create one per loop, share it between the requests made from that loop, and close
+    # it with `async with` or aclose().
+    def __init__(self, backend=None):
+        self.backend = backend or llm_backend()
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout))
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def stream_chat_completion(self, payload):
+        # Yields the raw SSE lines like stream_chat_completion, holding a concurrency slot of this client
+        async with self.semaphore:
+            response = await self._send(payload)
+            try:
+                async for line in response.aiter_lines():
+                    # Older httpx versions keep the line terminator
+                    yield line.rstrip("\r\n").encode()
+            finally:
+                await response.aclose()
+
+    async def _send(self, payload):
+        # Connection errors and retryable statuses are retried with backoff, like the sessions' adapter does
+        for attempt in range(max_retries + 1):
+            try:
+                request = self.client.build_request("POST", api_base(self.backend) + "/chat/completions",
+                                                    headers=api_headers(self.backend), json=payload)
+                response = await self.client.send(request, stream=True)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                if attempt == max_retries:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == max_retries:
+                    return response
+                await response.aclose()
+            await asyncio.sleep(retry_backoff * 2 ** attempt)
@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import uuid
+import queue
+import atexit
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from termcolor import colored
+
+# Per-stage latency spans of the question pipeline, served to Prometheus and optionally logged as JSON lines
+metrics_port = int(os.environ["METRICS_PORT"]) if os.environ.get("METRICS_PORT") else None
+trace_log_path = os.environ.get("TRACE_LOG_PATH")
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+_stages = {}  # stage -> {"buckets": [count per bucket, +Inf last], "sum", "count", "errors", "chars", "tokens"}
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+_trace_queue = queue.SimpleQueue()
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _stage(stage):
+    if stage not in _stages:
+        _stages[stage] = {"buckets": [0] * (len(BUCKETS) + 1), "sum": 0.0, "count": 0, "errors": 0,
+                          "chars": 0, "tokens": 0}
+    return _stages[stage]
+
+
+def observe(stage, seconds, fields=None, error=None, trace=None):
+    fields = fields or {}
+    with _lock:
+        entry = _stage(stage)
+        entry["buckets"][bisect.bisect_left(BUCKETS, seconds)] += 1
+        entry["sum"] += seconds
+        entry["count"] += 1
+        entry["errors"] += error is not None
+        entry["chars"] += fields.get("chars", 0)
+        entry["tokens"] += fields.get("tokens", 0)
+    if trace_log_path:
+        record = {"ts": time.time(), "trace": trace or _trace_id.get(), "stage": stage, "ms": seconds * 1000}
+        record.update(fields)
+        if error is not None:
+            record["error"] = error
+        _enqueue(record)
+
+
+@contextmanager
+def span(stage, trace=None, **fields):
+    # Times the block; the caller may add fields (e.g. chars, tokens) to the yielded dict
+    start = time.perf_counter()
+    error = None
+    try:
+        yield fields
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        observe(stage, time.perf_counter() - start, fields, error, trace)
+
+
+@contextmanager
+def trace(trace_id=None):
+    # Groups the spans of one question; work submitted to other threads needs contextvars.copy_context()
+    trace_id = trace_id or uuid.uuid4().hex[:16]
+    token = _trace_id.set(trace_id)
+    try:
+        yield trace_id
+    finally:
+        _trace_id.reset(token)
+
+
+def current_trace():
+    return _trace_id.get()
+
+
+def _enqueue(record):
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = threading.Thread(target=_write_traces, daemon=True)
+                _writer.start()
+    _trace_queue.put(record)
+
+
+def _drain(first=None):
+    records = [] if first is None else [first]
+    while True:
+        try:
+            records.append(_trace_queue.get_nowait())
+        except queue.Empty:
+            return records
+
+
+def _append(records):
+    if records:
+        with open(trace_log_path, "a") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records))
+
+
+def _write_traces():
+    # File I/O stays off the request threads; bursts are written in one append
+    while True:
+        records = _drain(_trace_queue.get())
+        try:
+            _append(records)
+        except OSError as e:
+            print(colored(f"Failed to write the trace log: {e}", "red"))
+
+
+@atexit.register
+def flush_traces():
+    if trace_log_path:
+        _append(_drain())
+
+
+def snapshot():
+    # Per-stage summary, e.g. for benchmarks
+    with _lock:
+        stages = {stage: dict(entry, buckets=list(entry["buckets"])) for stage, entry in _stages.items()}
+    for entry in stages.values():
+        entry["mean_ms"] = entry["sum"] / entry["count"] * 1000 if entry["count"] else 0.0
+        entry["p50_ms"] = _quantile(entry["buckets"], entry["count"], 0.5) * 1000
+        entry["p95_ms"] = _quantile(entry["buckets"], entry["count"], 0.95) * 1000
+        del entry["buckets"]
+    return stages
+
+
+def _quantile(buckets, count, q):
+    # Upper bound of the bucket that holds the quantile
+    seen = 0
+    for bound, bucket_count in zip(BUCKETS + (float("inf"),), buckets):
+        seen += bucket_count
+        if count and seen >= q * count:
+            return bound if bound != float("inf") else BUCKETS[-1]
+    return 0.0
+
+
+def reset():
+    with _lock:
+        _stages.clear()
+
+
+def render_prometheus():
+    with _lock:
+        stages = {stage: dict(entry, buckets=list(entry["buckets"])) for stage, entry in sorted(_stages.items())}
+    lines = ["# HELP code_learner_stage_duration_seconds Latency of the question pipeline stages.",
+             "# TYPE code_learner_stage_duration_seconds histogram"]
+    for stage, entry in stages.items():
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS + (float("inf"),), entry["buckets"]):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'code_learner_stage_duration_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+        lines.append(f'code_learner_stage_duration_seconds_sum{{stage="{stage}"}} {entry["sum"]}')
+        lines.append(f'code_learner_stage_duration_seconds_count{{stage="{stage}"}} {entry["count"]}')
+    for name, key, description in [("errors", "errors", "Stages that raised an exception."),
+                                   ("chars", "chars", "Characters produced or assembled by the stages."),
+                                   ("tokens", "tokens", "Tokens produced or assembled by the stages.")]:
+        lines += [f"# HELP code_learner_stage_{name}_total {description}",
+                  f"# TYPE code_learner_stage_{name}_total counter"]
+        lines += [f'code_learner_stage_{name}_total{{stage="{stage}"}} {entry[key]}' for stage, entry in stages.items()]
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        data = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_server(port=metrics_port, host="0.0.0.0"):
+    # Serves /metrics in a background thread; no-op without a port
+    if port is None:
+        return None
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(colored(f"Metrics available at http://{host}:{port}/metrics", "green"))
+    return server
@@ -0,0 +1,89 @@
+import os
+import threading
+from collections import OrderedDict
+from termcolor import colored
+
+# Process-wide LRU cache of expensive resources (embedding models, loaded vector stores)
+cache_max_bytes = int(os.environ.get("VDB_CACHE_MAX_BYTES", 4 * 1024 ** 3))
+
+_lock = threading.Lock()
+_key_locks = {}
+_singletons = {}
+_entries = OrderedDict()  # key -> {"value", "signature", "size"}
+
+
+def _key_lock(key):
+    with _lock:
+        if key not in _key_locks:
+            _key_locks[key] = threading.Lock()
+        return _key_locks[key]
+
+
+def file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def get_singleton(key, factory):
+    # Resources that are never evicted, e.g. the embedding model
+    if key in _singletons:
+        return _singletons[key]
+    with _key_lock(key):
+        if key not in _singletons:
+            _singletons[key] = factory()
+        return _singletons[key]
+
+
+def get_cached(key, signature, loader, size_fn=None):
+    # signature changes (e.g. the stat of an index header) invalidate the cached value
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry["signature"] == signature:
+            _entries.move_to_end(key)
+            return entry["value"]
+
+    # Loads of the same key are serialized so concurrent questions don't load it twice
+    with _key_lock(key):
+        with _lock:
+            entry = _entries.get(key)
+            if entry is not None and entry["signature"] == signature:
+                _entries.move_to_end(key)
+                return entry["value"]
+        value = loader()
+        put(key, signature, value, size_fn)
+        return value
+
+
+def put(key, signature, value, size_fn=None):
+    size = size_fn(value) if size_fn is not None else 0
+    with _lock:
+        _entries[key] = {"value": value, "signature": signature, "size": size}
+        _entries.move_to_end(key)
+        _evict()
+
+
+def invalidate(key):
+    with _lock:
+        _entries.pop(key, None)
+
+
+def _evict():
+    # Always keep the most recently used entry, even if it alone exceeds the cap
+    total = sum(entry["size"] for entry in _entries.values())
+    while total > cache_max_bytes and len(_entries) > 1:
+        key, entry = _entries.popitem(last=False)
+        total -= entry["size"]
+        print(colored(f"Evicted {key} from the cache ({entry['size'] / 1024 ** 2:.1f} MB)", "yellow"))
+
+
+def stats():
+    with _lock:
+        return {
+            "entries": len(_entries),
+            "bytes": sum(entry["size"] for entry in _entries.values()),
+            "max_bytes": cache_max_bytes,
+            "keys": list(_entries),
+        }
@@ -1,64 +1,248 @@
 import os
 import json
+import hashlib
 import openai
 from termcolor import colored
 from dotenv import load_dotenv, find_dotenv
-from knowledge_base import load_documents, load_code_chunks, supabase_vdb, local_vdb, load_local_vdb
+from knowledge_base import load_code_chunks, supabase_vdb, load_local_vdb, save_local_vdb, \
+    read_vdb_header, convert_pickled_vdb, estimate_vdb_bytes, get_embedding, empty_vdb, remove_documents_from_vdb
 from collections import deque
-from pathlib import Path
 import util
+import registry
+import retrieval
+import ann_index
+import metrics
+from ingestion import ingest_files, load_file_documents
+from symbol_index import SymbolIndex
+from call_graph import CallGraph
+from lexical_index import BM25Index
+import shutil
 import subprocess
+import threading
 import gradio as gr
 
 
+def repo_name_from_url(git_url):
+    # Folder name `git clone` would use, e.g. https://github.com/user/repo.git -> repo
+    return git_url.strip().rstrip("/").split("/")[-1].split(":")[-1].removesuffix(".git")
+
+
+def normalize_git_url(git_url):
+    git_url = git_url.strip().rstrip("/")
+    if os.path.isdir(git_url):
+        # Local paths are cloned through file:// so that --depth is honoured
+        return "file://" + os.path.abspath(git_url)
+    return git_url
+
+
+def same_repo_url(first, second):
+    return normalize_git_url(first).removesuffix(".git") == normalize_git_url(second).removesuffix(".git")
+
+
+def run_git(args, cwd):
+    return subprocess.run(['git'] + args, cwd=cwd, check=True, capture_output=True, text=True).stdout.strip()
+
+
+def is_repo_folder(path):
+    return os.path.isdir(os.path.join(path, ".git"))
+
+
+def checkout_url(repo_folder):
+    try:
+        return run_git(['remote', 'get-url', 'origin'], repo_folder)
+    except subprocess.CalledProcessError:
+        return None
+
+
+def repo_checkout_folder(git_url, code_repo_path="./code_repo"):
+    # Each repo URL is its own namespace: a checkout folder, and through get_vdb_path its own index files.
+    # The folder is named like `git clone` would, unless another repo (e.g. a fork) already uses that name.
+    name = repo_name_from_url(git_url)
+    repo_folder = os.path.join(code_repo_path, name)
+    if not os.path.exists(repo_folder):
+        return repo_folder
+    cached_url = checkout_url(repo_folder) if is_repo_folder(repo_folder) else None
+    if cached_url is not None and same_repo_url(cached_url, git_url):
+        return repo_folder
+    return fork_checkout_folder(git_url, code_repo_path)
+
+
+def fork_checkout_folder(git_url, code_repo_path="./code_repo"):
+    digest = hashlib.sha1(normalize_git_url(git_url).removesuffix(".git").encode("utf-8")).hexdigest()[:8]
+    return os.path.join(code_repo_path, f"{repo_name_from_url(git_url)}-{digest}")
+
+
+def sync_repo(git_url, code_repo_path="./code_repo", repo_folder=None):
+    # Clones `git_url` once (shallow and blobless) and fast-forwards the cached checkout on later calls.
+    # Returns the checkout folder and the changed file paths, or None after a fresh clone (everything changed).
+    url = normalize_git_url(git_url)
+    repo_folder = repo_folder or repo_checkout_folder(git_url, code_repo_path)
+    if is_repo_folder(repo_folder):
+        cached_url = checkout_url(repo_folder)
+        if cached_url is not None and same_repo_url(cached_url, url):
+            old_head = run_git(['rev-parse', 'HEAD'], repo_folder)
+            try:
+                run_git(['fetch', '--depth', '1', '--filter=blob:none', '--no-tags', 'origin', 'HEAD'], repo_folder)
+                run_git(['reset', '--hard', 'FETCH_HEAD'], repo_folder)
+            except subprocess.CalledProcessError as e:
+                print(colored(f"Failed to update {git_url}, using the cached checkout: {e.stderr}", "red"))
+                return repo_folder, []
+            new_head = run_git(['rev-parse', 'HEAD'], repo_folder)
+            if new_head == old_head:
+                print(colored(f"{git_url} is up to date", "green"))
+                return repo_folder, []
+            diff = run_git(['diff', '--name-only', '--no-renames', old_head, new_head], repo_folder)
+            changed = [os.path.join(repo_folder, path) for path in diff.splitlines() if path]
+            print(colored(f"Updated {git_url} to {new_head[:10]}, {len(changed)} files changed", "green"))
+            return repo_folder, changed
+    if os.path.exists(repo_folder):
+        # Left behind by an interrupted clone
+        shutil.rmtree(repo_folder)
+
+    run_git(['clone', '--depth', '1', '--filter=blob:none', '--no-tags', '--single-branch', url, repo_folder], None)
+    print(f"Successfully cloned {git_url} into {code_repo_path}")
+    return repo_folder, None
+
+
 def clone_repo(git_url, progress=gr.Progress(), code_repo_path="./code_repo"):
+    # Returns the repo information for the system prompt, the checkout folder (the repo's namespace)
+    # and the changed files (None after a fresh clone); the information is None if cloning failed
     print(progress(0.1, desc="Cloning the repo..."))
     print("Cloning the repo: ", git_url)
     # Check if directory exists
     if not os.path.exists(code_repo_path):
         os.makedirs(code_repo_path)
     try:
-        subprocess.check_call(['git', 'clone', git_url], cwd=code_repo_path)
-        print(f"Successfully cloned {git_url} into {code_repo_path}")
+        repo_folder, changed = sync_repo(git_url, code_repo_path)
     except subprocess.CalledProcessError as e:
-        print(f"Error: {e.output}")
+        print(f"Error: {e.stderr}")
+        return None, None, None
 
     print(progress(0.3, desc="Summarizing the repo..."))
-    readme_info = get_readme(code_repo_path)
+    return describe_repo(repo_folder), repo_folder, changed
+
+
+def describe_repo(repo_folder):
+    # README summary and structure of the checkout, for the system prompt
+    readme_info = get_readme(repo_folder)
     if readme_info is not None:
         readme_info = """The README.md file is as follows: """ + readme_info + "\n\n"
 
-    print(progress(0.4, desc="Parsing repo structure..."))
-    repo_structure = get_repo_structure(code_repo_path)
+    repo_structure = get_repo_structure(repo_folder)
     if repo_structure is not None:
-        repo_structure = """The repo structure is as follows: """ + get_repo_structure(code_repo_path) + "\n\n"
+        repo_structure = """The repo structure is as follows: """ + repo_structure + "\n\n"
 
     return readme_info + repo_structure
 
 
-def generate_knowledge_from_repo(dir_path, ignore_list):
-    knowledge = {"known_docs": [], "known_text": {"pages": [], "metadatas": []}}
+default_ignore_list = ['.git', 'node_modules', '__pycache__', '.idea', '.vscode']
+MANIFEST_VERSION = 2
+
+
+def walk_repo_files(dir_path, ignore_list):
     for root, dirs, files in os.walk(dir_path):
         dirs[:] = [d for d in dirs if d not in ignore_list]  # modify dirs in-place
         for file in files:
             if file in ignore_list:
                 continue
-            filepath = os.path.join(root, file)
-            try:
-                # Using a more general way for code file parsing
-                knowledge["known_docs"].extend(load_documents([filepath]))
+            yield os.path.join(root, file)
+
 
-            except Exception as e:
-                print(f"Failed to process {filepath} due to error: {str(e)}")
+def generate_knowledge_from_repo(dir_path, ignore_list):
+    knowledge = {"known_docs": [], "known_text": {"pages": [], "metadatas": []}}
+    for filepath in walk_repo_files(dir_path, ignore_list):
+        knowledge["known_docs"].extend(load_file_documents(filepath)[1])
 
     return knowledge
 
 
+def hash_file(filepath):
+    sha = hashlib.sha1()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def load_manifest(manifest_path):
+    if not os.path.isfile(manifest_path):
+        return None
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def save_json_atomic(data, path):
+    # Readers see either the previous file or the complete new one
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def touched_files(dir_path, files_manifest, ignore_list, paths):
+    # The files to check for touched `paths` (files or directories, e.g. from a file watcher), and the manifest
+    # entries of everything else, which are kept as they are; both relative to dir_path like the manifest keys
+    filepaths, prefixes = set(), []
+    for path in paths:
+        relpath = os.path.relpath(path, dir_path)
+        if relpath.split(os.sep)[0] == os.pardir or set(relpath.split(os.sep)) & set(ignore_list):
+            continue
+        if os.path.isdir(path):
+            filepaths.update(os.path.relpath(filepath, dir_path) for filepath in walk_repo_files(path, ignore_list))
+            prefixes.append("" if relpath == os.curdir else os.path.join(relpath, ""))
+        else:
+            filepaths.add(relpath)
+    prefixes = tuple(prefixes)
+    untouched = {filepath: entry for filepath, entry in files_manifest.items()
+                 if filepath not in filepaths and not filepath.startswith(prefixes)}
+    return sorted(filepaths), untouched
+
+
+def diff_repo_files(dir_path, files_manifest, ignore_list, paths=None):
+    # Returns the current file entries plus the added/modified and deleted paths, all relative to dir_path,
+    # so the manifest stays valid however dir_path is spelled.
+    # The content hash is only recomputed when size or mtime changed since the last build.
+    # Entries of unchanged files keep their extra fields; new entries only have size, mtime_ns and hash.
+    # With `paths`, only the touched files are checked instead of walking the repo.
+    if paths is None:
+        filepaths = (os.path.relpath(filepath, dir_path) for filepath in walk_repo_files(dir_path, ignore_list))
+        current = {}
+    else:
+        filepaths, current = touched_files(dir_path, files_manifest, ignore_list, paths)
+    changed = []
+    for filepath in filepaths:
+        try:
+            stat = os.stat(os.path.join(dir_path, filepath))
+        except OSError:
+            continue
+        old = files_manifest.get(filepath)
+        if old is not None and old["size"] == stat.st_size and old["mtime_ns"] == stat.st_mtime_ns:
+            current[filepath] = old
+            continue
+        try:
+            digest = hash_file(os.path.join(dir_path, filepath))
+        except OSError as e:
+            print(f"Failed to hash {filepath} due to error: {str(e)}")
+            continue
+        if old is not None and old["hash"] == digest:
+            current[filepath] = dict(old, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+        else:
+            current[filepath] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": digest}
+            changed.append(filepath)
+    deleted = [filepath for filepath in files_manifest if filepath not in current]
+    return current, changed, deleted
+
+
 # Find the Readme.md file from the code repo in the code_repo folder
 def find_repo_folder(directory):
+    if is_repo_folder(directory):
+        return directory
     # Find the name of the folder in the specified directory
     folder_name = None
-    for item in os.listdir(directory):
+    for item in sorted(os.listdir(directory)):
         item_path = os.path.join(directory, item)
         if os.path.isdir(item_path):
             folder_name = item
@@ -94,38 +278,142 @@ def summarize_readme(readme_path):
         return util.get_chat_response(system_prompt, user_prompt)
 
 
-def bfs_folder_search(text_length_limit=4000, folder_path="./code_repo"):
-    if not Path(folder_path).is_dir():
-        return "Invalid directory path"
+STRUCTURE_VERSION = 1
+# Directories with more files than this list them as counts per extension
+max_listed_files = 20
 
-    root = Path(folder_path).resolve()
-    file_structure = {str(root): {}}
-    queue = deque([(root, file_structure[str(root)])])
 
+def scan_repo_tree(folder_path, ignore_list=default_ignore_list):
+    # One os.scandir pass over the tree; every directory gets its direct entries ("dirs", "files")
+    # and the file counts of its whole subtree ("total", "extensions")
+    nodes = {folder_path: {"name": os.path.basename(os.path.abspath(folder_path)), "depth": 0,
+                           "dirs": [], "files": []}}
+    order = [folder_path]
+    queue = deque([folder_path])
     while queue:
-        current_dir, parent_node = queue.popleft()
+        current = queue.popleft()
+        node = nodes[current]
         try:
-            for path in current_dir.iterdir():
-                if path.is_dir():
-                    if str(path.name) == ".git":
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.name in ignore_list:
                         continue
-                    parent_node[str(path.name)] = {"files": []}
-                    queue.append((path, parent_node[str(path.name)]))
-                else:
-                    if "files" not in parent_node:
-                        parent_node["files"] = []
-                    parent_node["files"].append(str(path.name))
-
-                # Check if we've exceeded the text length limit
-                file_structure_text = json.dumps(file_structure)
-                if len(file_structure_text) >= text_length_limit:
-                    return file_structure_text
-
-        except PermissionError:
-            # This can happen in directories the user doesn't have permission to read.
+                    if entry.is_dir(follow_symlinks=False):
+                        nodes[entry.path] = {"name": entry.name, "depth": node["depth"] + 1, "dirs": [], "files": []}
+                        node["dirs"].append(entry.path)
+                        order.append(entry.path)
+                        queue.append(entry.path)
+                    else:
+                        node["files"].append(entry.name)
+        except OSError:
+            # e.g. directories the user doesn't have permission to read
+            continue
+        node["dirs"].sort()
+        node["files"].sort()
+
+    # Children come after their parents in BFS order, so subtree counts are aggregated in reverse
+    for path in reversed(order):
+        node = nodes[path]
+        extensions = {}
+        for name in node["files"]:
+            extension = os.path.splitext(name)[1] or "(no extension)"
+            extensions[extension] = extensions.get(extension, 0) + 1
+        node["total"] = len(node["files"])
+        for child in node["dirs"]:
+            node["total"] += nodes[child]["total"]
+            for extension, count in nodes[child]["extensions"].items():
+                extensions[extension] = extensions.get(extension, 0) + count
+        node["extensions"] = extensions
+    return nodes
+
+
+def format_counts(total, extensions, top=3):
+    # e.g. "1,240 .py files" or "310 files (250 .py, 40 .json, 20 other)"
+    if total == 0:
+        return "empty"
+    ranked = sorted(extensions.items(), key=lambda item: (-item[1], item[0]))
+    if len(ranked) == 1:
+        return f"{total:,} {ranked[0][0]} file{'s' if total != 1 else ''}"
+    parts = [f"{count:,} {extension}" for extension, count in ranked[:top]]
+    other = sum(count for _, count in ranked[top:])
+    if other:
+        parts.append(f"{other:,} other")
+    return f"{total:,} files ({', '.join(parts)})"
+
+
+def summarize_tree(nodes, root, text_length_limit=4000):
+    # Directories are expanded breadth-first while the text fits the limit; the rest stay collapsed into counts.
+    # The size is tracked per line, so the whole tree is never re-serialized.
+    def cost(depth, text):
+        return 2 * depth + len(text) + 1
+
+    def collapsed(path):
+        node = nodes[path]
+        return f"{node['name']}/: {format_counts(node['total'], node['extensions'])}"
+
+    def file_lines(node):
+        if len(node["files"]) <= max_listed_files:
+            return list(node["files"])
+        counts = {}
+        for name in node["files"]:
+            extension = os.path.splitext(name)[1] or "(no extension)"
+            counts[extension] = counts.get(extension, 0) + 1
+        return [f"{count:,} {extension} file{'s' if count != 1 else ''}" for extension, count in
+                sorted(counts.items(), key=lambda item: (-item[1], item[0]))]
+
+    expanded = {}
+    size = cost(0, collapsed(root))
+    queue = deque([root])
+    while queue:
+        path = queue.popleft()
+        node = nodes[path]
+        depth = node["depth"] + 1
+        lines = file_lines(node)
+        expansion = cost(node["depth"], node["name"] + "/") - cost(node["depth"], collapsed(path))
+        expansion += sum(cost(depth, collapsed(child)) for child in node["dirs"])
+        expansion += sum(cost(depth, line) for line in lines)
+        if size + expansion > text_length_limit:
+            continue
+        size += expansion
+        expanded[path] = lines
+        queue.extend(node["dirs"])
+
+    output = []
+    stack = [root]
+    while stack:
+        path = stack.pop()
+        node = nodes[path]
+        indent = "  " * node["depth"]
+        if path not in expanded:
+            output.append(indent + collapsed(path))
             continue
+        output.append(indent + node["name"] + "/")
+        output.extend(indent + "  " + line for line in expanded[path])
+        stack.extend(reversed(node["dirs"]))
+    return "\n".join(output)
 
-    return json.dumps(file_structure)
+
+def bfs_folder_search(text_length_limit=4000, folder_path="./code_repo"):
+    if not os.path.isdir(folder_path):
+        return "Invalid directory path"
+    return summarize_tree(scan_repo_tree(folder_path), folder_path, text_length_limit)
+
+
+def get_repo_commit(code_repo_path="./code_repo"):
+    # HEAD commits of the cloned repos, or None if any of them is not a git checkout
+    commits = []
+    if is_repo_folder(code_repo_path):
+        repo_folders = [code_repo_path]
+    else:
+        repo_folders = [os.path.join(code_repo_path, name) for name in sorted(os.listdir(code_repo_path))]
+    for repo_folder in repo_folders:
+        if not os.path.isdir(repo_folder):
+            continue
+        result = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repo_folder, capture_output=True, text=True)
+        if result.returncode != 0:
+            return None
+        commits.append(result.stdout.strip())
+    return "-".join(commits) or None
 
 
 def get_readme(code_repo_path="./code_repo"):
@@ -140,8 +428,22 @@ def get_readme(code_repo_path="./code_repo"):
         return summary
 
 
-def get_repo_structure(code_repo_path="./code_repo"):
-    return bfs_folder_search(4000, code_repo_path)
+def get_repo_structure(code_repo_path="./code_repo", text_length_limit=4000):
+    # Cached per commit next to the VDB, so re-analyzing an unchanged repo does not walk the tree again
+    commit = get_repo_commit(code_repo_path)
+    cache_path = os.path.join(get_vdb_path(code_repo_path), "structure.json")
+    key = {"version": STRUCTURE_VERSION, "commit": commit, "limit": text_length_limit}
+    if commit is not None and os.path.isfile(cache_path):
+        with open(cache_path, "r") as f:
+            cached = json.load(f)
+        if all(cached.get(name) == value for name, value in key.items()):
+            return cached["text"]
+
+    structure = bfs_folder_search(text_length_limit, code_repo_path)
+    if commit is not None:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        save_json_atomic(dict(key, text=structure), cache_path)
+    return structure
 
 
 def get_repo_names(dir_path):
@@ -150,30 +452,226 @@ def get_repo_names(dir_path):
     return concatenated_names
 
 
-def generate_or_load_knowledge_from_repo(dir_path="./code_repo"):
-    vdb_path = "./vdb-" + get_repo_names(dir_path) + ".pkl"
-    # check if vdb_path exists
-    if os.path.isfile(vdb_path):
+def get_vdb_path(dir_path="./code_repo"):
+    # Every checkout folder is the namespace of its own store
+    return "./vdb-" + os.path.basename(os.path.normpath(dir_path))
+
+
+def default_repo_folder(code_repo_path="./code_repo"):
+    # For sessions that did not analyze a repo: the only checkout if there is one. None if there are
+    # none or several, since a store combining several repos would mix their answers.
+    if not os.path.isdir(code_repo_path):
+        return None
+    folders = [os.path.join(code_repo_path, name) for name in sorted(os.listdir(code_repo_path))
+               if os.path.isdir(os.path.join(code_repo_path, name))]
+    return folders[0] if len(folders) == 1 else None
+
+
+def generate_or_load_knowledge_from_repo(dir_path="./code_repo", progress=None, publish=None, paths=None):
+    # progress(files_done, files_total, chunks_done) follows the embedding of changed files.
+    # publish(vdb, lock) is called with a store that is built from scratch before any chunk is added,
+    # so it can be searched (holding `lock`) while it grows; updates keep serving the saved store instead.
+    # paths restricts the diff against the manifest to the touched files (see diff_repo_files).
+    vdb_path = get_vdb_path(dir_path)
+    manifest_path = os.path.join(vdb_path, "manifest.json")
+
+    # Stores written by older versions are pickles; convert them once to the on-disk format
+    legacy_path = vdb_path + ".pkl"
+    if read_vdb_header(vdb_path) is None and os.path.isfile(legacy_path):
+        convert_pickled_vdb(legacy_path, vdb_path)
+        if os.path.isfile(vdb_path + ".manifest.json"):
+            os.replace(vdb_path + ".manifest.json", manifest_path)
+
+    # The manifest records the content hash and chunk ids of every indexed file.
+    # Without it an existing VDB cannot be diffed against the repo, so it is rebuilt.
+    manifest = load_manifest(manifest_path)
+    embedding = get_embedding()
+    vdb = None
+    if manifest is not None and read_vdb_header(vdb_path) is not None:
         print(colored("Local VDB found! Loading VDB from file...", "green"))
-        vdb = load_local_vdb(vdb_path)
+        vdb = load_local_vdb(vdb_path, embedding)
     else:
         print(colored("Generating VDB from repo...", "green"))
-        ignore_list = ['.git', 'node_modules', '__pycache__', '.idea',
-                       '.vscode']
-        knowledge = generate_knowledge_from_repo(dir_path, ignore_list)
-        vdb = local_vdb(knowledge, vdb_path=vdb_path)
+        manifest = {"version": MANIFEST_VERSION, "files": {}}
+        paths = None
+
+    files, changed, deleted = diff_repo_files(dir_path, manifest["files"], default_ignore_list, paths)
+    # Chunks that no manifest entry refers to were left behind by an interrupted update
+    known_ids = {doc_id for entry in manifest["files"].values() for doc_id in entry["ids"]}
+    orphan_ids = [doc_id for doc_id in (vdb.index_to_docstore_id.values() if vdb is not None else [])
+                  if doc_id not in known_ids]
+    if vdb is not None and not changed and not deleted and not orphan_ids:
+        print(colored("VDB is up to date!", "green"))
+        cache_vdb(vdb_path, vdb)
+        update_lexical_index(vdb_path, vdb)
+        return vdb
+    print(colored(f"Re-indexing {len(changed)} changed and {len(deleted)} deleted files...", "green"))
+
+    # The lexical index is updated with the same chunk ids, unless it does not match the stored VDB
+    lexical_index = None
+    lock = threading.Lock()
+    if vdb is None:
+        vdb = empty_vdb(embedding)
+        if publish is not None:
+            publish(vdb, lock)
+    else:
+        lexical_index = load_matching_lexical_index(vdb_path)
+        # The memory-mapped store is read-only, updates need a fully loaded copy
+        vdb = load_local_vdb(vdb_path, embedding, use_mmap=False)
+
+    stale_ids = orphan_ids + [doc_id for filepath in deleted for doc_id in manifest["files"][filepath]["ids"]]
+    stale_ids += [doc_id for filepath in changed if filepath in manifest["files"]
+                  for doc_id in manifest["files"][filepath]["ids"]]
+    remove_documents_from_vdb(vdb, stale_ids)
+
+    added_ids = []
+    ingested = ingest_files([os.path.join(dir_path, filepath) for filepath in changed], vdb, embedding,
+                            progress=progress, lock=lock)
+    for filepath, ids in ingested.items():
+        files[os.path.relpath(filepath, dir_path)]["ids"] = ids
+        added_ids.extend(ids)
+    with lock:
+        ann_index.maybe_upgrade(vdb)
+    if lexical_index is not None:
+        lexical_index.remove(stale_ids)
+        lexical_index.add({doc_id: vdb.docstore.search(doc_id).page_content for doc_id in added_ids})
+
+    # Save the VDB before the manifest; chunks orphaned by a crash in between are dropped on the next update
+    save_local_vdb(vdb, vdb_path)
+    manifest["files"] = files
+    save_json_atomic(manifest, manifest_path)
+    cache_vdb(vdb_path, vdb)
+    update_lexical_index(vdb_path, vdb, lexical_index)
     print(colored("VDB generated!", "green"))
     return vdb
 
 
-def get_repo_context(query, vdb):
-    matched_docs = vdb.similarity_search(query, k=10)
-    output = ""
-    for idx, docs in enumerate(matched_docs):
-        output += f"Context {idx}:\n"
-        output += str(docs)
-        output += "\n\n"
-    return output
+def cache_vdb(vdb_path, vdb):
+    registry.put(vdb_path, registry.file_signature(os.path.join(vdb_path, "header.json")), vdb, estimate_vdb_bytes)
+
+
+def build_lexical_index(vdb):
+    lexical_index = BM25Index()
+    lexical_index.add({doc_id: vdb.docstore.search(doc_id).page_content
+                       for doc_id in vdb.index_to_docstore_id.values()})
+    return lexical_index
+
+
+def load_matching_lexical_index(vdb_path):
+    # None if missing or written for another VDB generation (e.g. interrupted between the two saves)
+    lexical_index = BM25Index.load(os.path.join(vdb_path, "lexical.json"))
+    header = read_vdb_header(vdb_path)
+    if lexical_index is None or header is None or lexical_index.generation != header["generation"]:
+        return None
+    return lexical_index
+
+
+def update_lexical_index(vdb_path, vdb, lexical_index=None):
+    # Saves the BM25 index of the VDB just saved at vdb_path, rebuilding it from the chunks when needed
+    lexical_path = os.path.join(vdb_path, "lexical.json")
+    if lexical_index is None:
+        lexical_index = load_matching_lexical_index(vdb_path)
+        if lexical_index is not None:
+            registry.put(lexical_path, registry.file_signature(lexical_path), lexical_index,
+                         estimate_lexical_index_bytes)
+            return lexical_index
+        print(colored("Building the lexical index...", "green"))
+        lexical_index = build_lexical_index(vdb)
+    lexical_index.generation = read_vdb_header(vdb_path)["generation"]
+    lexical_index.save(lexical_path)
+    registry.put(lexical_path, registry.file_signature(lexical_path), lexical_index, estimate_lexical_index_bytes)
+    return lexical_index
+
+
+def estimate_lexical_index_bytes(lexical_index):
+    return sum(len(entry["terms"]) for entry in lexical_index.docs.values()) * 150
+
+
+def load_lexical_index(dir_path="./code_repo"):
+    # Question path; None for stores without a lexical index, which then use vector search only
+    lexical_path = os.path.join(get_vdb_path(dir_path), "lexical.json")
+    signature = registry.file_signature(lexical_path)
+    if signature is None:
+        return None
+    return registry.get_cached(lexical_path, signature, lambda: BM25Index.load(lexical_path),
+                               estimate_lexical_index_bytes)
+
+
+def load_knowledge_from_repo(dir_path="./code_repo"):
+    # Question path: reuse the resident VDB, reload only when the files on disk changed
+    vdb_path = get_vdb_path(dir_path)
+    signature = registry.file_signature(os.path.join(vdb_path, "header.json"))
+    if signature is None:
+        return generate_or_load_knowledge_from_repo(dir_path)
+    return registry.get_cached(vdb_path, signature, lambda: load_vdb_from_disk(vdb_path), estimate_vdb_bytes)
+
+
+def load_vdb_from_disk(vdb_path):
+    # Only actual loads are timed; questions served by the resident VDB are not
+    with metrics.span("vdb_load") as span:
+        vdb = load_local_vdb(vdb_path, get_embedding())
+        span["chunks"] = int(vdb.index.ntotal)
+    return vdb
+
+
+def estimate_symbol_index_bytes(symbol_index):
+    # Rough allowance per posting list entry
+    return sum(len(entry["tokens"]) for entry in symbol_index.files.values()) * 200
+
+
+def estimate_call_graph_bytes(call_graph):
+    return sum(len(entry["definitions"]) + len(entry["calls"]) for entry in call_graph.files.values()) * 300
+
+
+def generate_or_load_file_index(dir_path, filename, index_class, size_fn, paths=None):
+    # Per-file indexes (symbols, call graph) are built at analyze time next to the VDB
+    # and updated for changed files only
+    index_path = os.path.join(get_vdb_path(dir_path), filename)
+    index = index_class.load(index_path, dir_path)
+    if index is None:
+        index, paths = index_class(root=dir_path), None
+    files, changed, deleted = diff_repo_files(dir_path, index.files, default_ignore_list, paths)
+    if changed or deleted:
+        print(colored(f"Updating {filename} for {len(changed)} changed and {len(deleted)} deleted files...", "green"))
+        index.update(files, changed, deleted)
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        index.save(index_path)
+    registry.put(index_path, registry.file_signature(index_path), index, size_fn)
+    return index
+
+
+def load_file_index(dir_path, filename, index_class, size_fn):
+    index_path = os.path.join(get_vdb_path(dir_path), filename)
+    signature = registry.file_signature(index_path)
+    if signature is None:
+        return generate_or_load_file_index(dir_path, filename, index_class, size_fn)
+    return registry.get_cached(index_path, signature, lambda: index_class.load(index_path, dir_path), size_fn)
+
+
+def generate_or_load_symbol_index(dir_path="./code_repo", paths=None):
+    return generate_or_load_file_index(dir_path, "symbols.json", SymbolIndex, estimate_symbol_index_bytes, paths)
+
+
+def load_symbol_index(dir_path="./code_repo"):
+    return load_file_index(dir_path, "symbols.json", SymbolIndex, estimate_symbol_index_bytes)
+
+
+def generate_or_load_call_graph(dir_path="./code_repo", paths=None):
+    return generate_or_load_file_index(dir_path, "callgraph.json", CallGraph, estimate_call_graph_bytes, paths)
+
+
+def load_call_graph(dir_path="./code_repo"):
+    return load_file_index(dir_path, "callgraph.json", CallGraph, estimate_call_graph_bytes)
+
+
+def get_repo_context_chunks(query, vdb, lexical_index=None):
+    # One formatted chunk per matched span, most relevant first
+    matched_docs = retrieval.search(query, vdb, lexical_index=lexical_index)
+    return [f"Context {idx}:\n{docs}\n\n" for idx, docs in enumerate(matched_docs)]
+
+
+def get_repo_context(query, vdb, lexical_index=None):
+    return "".join(get_repo_context_chunks(query, vdb, lexical_index))
 
 
 if __name__ == '__main__':
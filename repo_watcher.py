@@ -0,0 +1,263 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+from termcolor import colored
+from repo_parser import default_ignore_list, walk_repo_files, is_repo_folder, get_vdb_path, read_vdb_header, \
+    generate_or_load_knowledge_from_repo, generate_or_load_symbol_index, generate_or_load_call_graph
+import indexing_jobs
+import metrics
+
+# Watch mode: re-indexes the touched files of local checkouts in the background
+watch_enabled = os.environ.get("WATCH_REPOS", "0") == "1"
+# auto, inotify or poll
+watch_backend = os.environ.get("WATCH_BACKEND", "auto")
+debounce_seconds = float(os.environ.get("WATCH_DEBOUNCE", 1.0))
+# Saves that never pause for debounce_seconds are still indexed after this long
+max_delay_seconds = float(os.environ.get("WATCH_MAX_DELAY", 10.0))
+poll_interval = float(os.environ.get("WATCH_POLL_INTERVAL", 2.0))
+# How often new checkouts are looked for
+rescan_interval = 10.0
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")
+
+_libc = None
+
+
+def libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    return _libc
+
+
+class InotifyWatcher:
+    # One watch per directory; directories created later are added when their creation is seen
+    def __init__(self, root, ignore_list=default_ignore_list):
+        if not sys.platform.startswith("linux"):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+        self.ignore_list = ignore_list
+        self.fd = libc().inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs = {}  # watch descriptor -> directory
+        try:
+            self._add_tree(root)
+        except OSError:
+            self.close()
+            raise
+
+    def _add_tree(self, path):
+        # Returns the files already in the tree
+        files = []
+        for root, dirs, names in os.walk(path):
+            dirs[:] = [d for d in dirs if d not in self.ignore_list]
+            wd = libc().inotify_add_watch(self.fd, os.fsencode(root), WATCH_MASK)
+            if wd < 0:
+                # ENOSPC: fs.inotify.max_user_watches is exhausted
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {root}")
+            self.dirs[wd] = root
+            files.extend(os.path.join(root, name) for name in names if name not in self.ignore_list)
+        return files
+
+    def poll(self, timeout):
+        # Returns the touched paths ([] on timeout), or None if the kernel dropped events
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        touched, overflow, offset = [], False, 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0"))
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            parent = self.dirs.get(wd)
+            if parent is None or name in self.ignore_list:
+                continue
+            path = os.path.join(parent, name) if name else parent
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                touched.extend(self._add_tree(path))
+            touched.append(path)
+        return None if overflow else touched
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    # Compares size and mtime of every file each interval
+    def __init__(self, root, ignore_list=default_ignore_list, interval=poll_interval):
+        self.root = root
+        self.ignore_list = ignore_list
+        self.interval = interval
+        self.files = self._scan()
+
+    def _scan(self):
+        files = {}
+        for filepath in walk_repo_files(self.root, self.ignore_list):
+            try:
+                stat = os.stat(filepath)
+            except OSError:
+                continue
+            files[filepath] = (stat.st_size, stat.st_mtime_ns)
+        return files
+
+    def poll(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        files = self._scan()
+        touched = [filepath for filepath, signature in files.items() if self.files.get(filepath) != signature]
+        touched += [filepath for filepath in self.files if filepath not in files]
+        self.files = files
+        return touched
+
+    def close(self):
+        pass
+
+
+def create_watcher(repo_folder, backend=watch_backend):
+    if backend in ("auto", "inotify"):
+        try:
+            return InotifyWatcher(repo_folder)
+        except OSError as e:
+            if backend == "inotify":
+                raise
+            print(colored(f"inotify unavailable for {repo_folder} ({e}), polling every {poll_interval}s", "yellow"))
+    return PollingWatcher(repo_folder)
+
+
+def refresh(repo_folder, paths):
+    # Re-indexes the touched paths (None: diff the whole repo) after any running analysis of the repo
+    with indexing_jobs.repo_lock(repo_folder):
+        with metrics.span("watch_refresh", files=len(paths) if paths is not None else -1):
+            generate_or_load_symbol_index(repo_folder, paths)
+            generate_or_load_call_graph(repo_folder, paths)
+            generate_or_load_knowledge_from_repo(repo_folder, paths=paths)
+
+
+class RepoWatcher:
+    def __init__(self, repo_folder, backend=watch_backend):
+        self.repo_folder = repo_folder
+        self.watcher = create_watcher(repo_folder, backend)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def _collect(self, touched):
+        # Debounce: keep collecting until no change for debounce_seconds, or for at most max_delay_seconds
+        pending, full, start = set(), False, time.monotonic()
+        while True:
+            if touched is None:
+                full = True
+            else:
+                pending.update(touched)
+            if time.monotonic() - start >= max_delay_seconds:
+                break
+            touched = self.watcher.poll(debounce_seconds)
+            if touched == []:
+                break
+        return None if full else sorted(pending)
+
+    def _run(self):
+        try:
+            while not self.stopped.is_set():
+                touched = self.watcher.poll(1.0)
+                if touched == []:
+                    continue
+                paths = self._collect(touched)
+                print(colored(f"{self.repo_folder} changed ({'all files' if paths is None else len(paths)}), "
+                              f"updating the indexes...", "green"))
+                try:
+                    refresh(self.repo_folder, paths)
+                except Exception as e:
+                    print(colored(f"Failed to update the indexes of {self.repo_folder}: {e}", "red"))
+        except OSError as e:
+            # e.g. the inotify watch limit was reached for new directories
+            print(colored(f"Stopped watching {self.repo_folder}: {e}", "red"))
+        finally:
+            self.watcher.close()
+
+
+_watchers = {}
+_watchers_lock = threading.Lock()
+
+
+def watch(repo_folder, backend=watch_backend):
+    with _watchers_lock:
+        watcher = _watchers.get(repo_folder)
+        if watcher is None or not watcher.thread.is_alive():
+            print(colored(f"Watching {repo_folder} for changes", "green"))
+            watcher = _watchers[repo_folder] = RepoWatcher(repo_folder, backend).start()
+        return watcher
+
+
+def watch_indexed_repos(code_repo_path="./code_repo"):
+    # Checkouts are watched once they have been analyzed
+    if not os.path.isdir(code_repo_path):
+        return
+    for name in sorted(os.listdir(code_repo_path)):
+        repo_folder = os.path.join(code_repo_path, name)
+        if is_repo_folder(repo_folder) and read_vdb_header(get_vdb_path(repo_folder)) is not None \
+                and indexing_jobs.active_job(repo_folder) is None:
+            watch(repo_folder)
+    with _watchers_lock:
+        for repo_folder in [folder for folder in _watchers if not os.path.isdir(folder)]:
+            _watchers.pop(repo_folder).stop()
+
+
+def start(code_repo_path="./code_repo"):
+    # Background thread for the GUI; no-op unless WATCH_REPOS=1
+    if not watch_enabled:
+        return None
+
+    def run():
+        while True:
+            watch_indexed_repos(code_repo_path)
+            time.sleep(rescan_interval)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    # python repo_watcher.py [repo folder ...]: keep the indexes of the given (or all analyzed) checkouts live
+    folders = sys.argv[1:]
+    for folder in folders:
+        watch(folder)
+    while True:
+        if not folders:
+            watch_indexed_repos()
+        time.sleep(rescan_interval)
@@ -0,0 +1,196 @@
+import os
+import re
+import numpy as np
+from langchain.docstore.document import Document
+from ann_index import search_parameters
+
+# Repo_Parser retrieval: vector and BM25 hits fused by reciprocal rank, merged into spans per file
+fetch_k = int(os.environ.get("RETRIEVAL_FETCH_K", 20))
+max_results = int(os.environ.get("RETRIEVAL_MAX_RESULTS", 10))
+# Hits whose distance exceeds the best hit's distance by more than this factor are dropped
+relative_cutoff = float(os.environ.get("RETRIEVAL_RELATIVE_CUTOFF", 1.5))
+# Optional absolute cutoff on the (squared L2) distance
+max_distance = float(os.environ["RETRIEVAL_MAX_DISTANCE"]) if os.environ.get("RETRIEVAL_MAX_DISTANCE") else None
+duplicate_threshold = float(os.environ.get("RETRIEVAL_DUPLICATE_THRESHOLD", 0.9))
+rrf_k = 60
+# Lexical hits scoring below this fraction of the best lexical hit are not fused
+lexical_cutoff = 0.3
+# Fast path: the best BM25 score is at least fast_path_min_score and at most fast_path_max_hits hits
+# score within fast_path_ratio of it
+fast_path_enabled = os.environ.get("HYBRID_FAST_PATH", "1") == "1"
+fast_path_min_score = float(os.environ.get("HYBRID_FAST_PATH_MIN_SCORE", 4.0))
+fast_path_ratio = 2.0
+fast_path_max_hits = 3
+# Chunks separated by at most this many characters (stripped whitespace) count as adjacent
+max_gap = 2
+# Minimum shared text for merging chunks of indexes built without start offsets
+min_overlap = 20
+shingle_size = 5
+
+WORD_RE = re.compile(r"\w+")
+
+
+def cutoff(hits):
+    # hits: tuples sorted by distance, with the distance last
+    if not hits:
+        return []
+    threshold = hits[0][-1] * relative_cutoff
+    if max_distance is not None:
+        threshold = min(threshold, max_distance)
+    return [hit for index, hit in enumerate(hits) if index == 0 or hit[-1] <= threshold]
+
+
+def text_overlap(first, second):
+    # Length of the longest suffix of `first` that is a prefix of `second` (at least min_overlap), else 0
+    if len(second) < min_overlap:
+        return 0
+    probe = second[:min_overlap]
+    position = first.find(probe, max(0, len(first) - len(second)))
+    while position != -1:
+        if second.startswith(first[position:]):
+            return len(first) - position
+        position = first.find(probe, position + 1)
+    return 0
+
+
+def _merge_with_offsets(hits):
+    spans = []
+    for doc, score in sorted(hits, key=lambda hit: hit[0].metadata["start_index"]):
+        start = doc.metadata["start_index"]
+        end = start + len(doc.page_content)
+        if spans and start <= spans[-1]["end"] + max_gap:
+            span = spans[-1]
+            if end > span["end"]:
+                if start >= span["end"]:
+                    span["text"] += "\n" + doc.page_content
+                else:
+                    span["text"] += doc.page_content[span["end"] - start:]
+                span["end"] = end
+            span["score"] = min(span["score"], score)
+        else:
+            spans.append({"start": start, "end": end, "text": doc.page_content, "score": score})
+    return spans
+
+
+def _merge_by_text(hits):
+    # Indexes built before chunks recorded their offsets: chain chunks whose ends repeat each other
+    spans = [{"start": None, "text": doc.page_content, "score": score} for doc, score in hits]
+    merged = True
+    while merged:
+        merged = False
+        for first in spans:
+            for second in spans:
+                if first is second:
+                    continue
+                if second["text"] not in first["text"]:
+                    overlap = text_overlap(first["text"], second["text"])
+                    if not overlap:
+                        continue
+                    first["text"] += second["text"][overlap:]
+                first["score"] = min(first["score"], second["score"])
+                second["text"] = ""
+                spans = [span for span in spans if span["text"]]
+                merged = True
+                break
+            if merged:
+                break
+    return spans
+
+
+def merge_hits(hits):
+    # Groups hits by source and merges overlapping or adjacent chunks; returns spans ranked by their best score
+    by_source = {}
+    for doc, score in hits:
+        by_source.setdefault(doc.metadata.get("source"), []).append((doc, score))
+    spans = []
+    for source, source_hits in by_source.items():
+        if all(doc.metadata.get("start_index", -1) >= 0 for doc, _ in source_hits):
+            source_spans = _merge_with_offsets(source_hits)
+        else:
+            source_spans = _merge_by_text(source_hits)
+        spans.extend(dict(span, source=source) for span in source_spans)
+    return sorted(spans, key=lambda span: span["score"])
+
+
+def shingles(text):
+    words = WORD_RE.findall(text.lower())
+    if len(words) <= shingle_size:
+        return {tuple(words)}
+    return {tuple(words[i:i + shingle_size]) for i in range(len(words) - shingle_size + 1)}
+
+
+def drop_near_duplicates(spans):
+    kept, kept_shingles = [], []
+    for span in spans:
+        current = shingles(span["text"])
+        # Containment rather than Jaccard, so a copy of part of an already kept span is dropped too
+        if any(len(current & other) / (len(current) or 1) >= duplicate_threshold for other in kept_shingles):
+            continue
+        kept.append(span)
+        kept_shingles.append(current)
+    return kept
+
+
+def vector_hits(query, vdb, k=fetch_k, nprobe=None, ef_search=None):
+    # Like FAISS.similarity_search_with_score, but keeps the docstore ids for fusion and takes ANN search knobs
+    vector = np.array([vdb.embedding_function(query)], dtype=np.float32)
+    distances, indices = vdb.index.search(vector, k, params=search_parameters(vdb.index, nprobe, ef_search))
+    hits = []
+    for distance, index in zip(distances[0], indices[0]):
+        if index == -1:
+            continue
+        doc_id = vdb.index_to_docstore_id[index]
+        doc = vdb.docstore.search(doc_id)
+        if isinstance(doc, Document):
+            hits.append((doc_id, doc, float(distance)))
+    return hits
+
+
+def lexical_hits(query, vdb, lexical_index, k=fetch_k):
+    hits = []
+    for doc_id, score in lexical_index.search(query, k):
+        doc = vdb.docstore.search(doc_id)
+        # The lexical index may briefly lag behind a VDB that is being updated
+        if isinstance(doc, Document):
+            hits.append((doc_id, doc, score))
+    return hits
+
+
+def is_decisive(hits):
+    if not hits or hits[0][2] < fast_path_min_score:
+        return False
+    return sum(1 for hit in hits if hit[2] * fast_path_ratio >= hits[0][2]) <= fast_path_max_hits
+
+
+def fuse(ranked_lists):
+    # Reciprocal rank fusion; returns [(doc, score)] with lower scores first, as merge_hits expects
+    scores, docs = {}, {}
+    for hits in ranked_lists:
+        for rank, (doc_id, doc, _) in enumerate(hits):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+            docs[doc_id] = doc
+    return sorted(((docs[doc_id], -score) for doc_id, score in scores.items()), key=lambda hit: hit[1])
+
+
+def ranked_hits(query, vdb, lexical_index=None, k=fetch_k, nprobe=None, ef_search=None):
+    if lexical_index is None:
+        return [(doc, distance) for _, doc, distance in cutoff(vector_hits(query, vdb, k, nprobe, ef_search))]
+    lexical = lexical_hits(query, vdb, lexical_index, k)
+    if fast_path_enabled and is_decisive(lexical):
+        # The query is not embedded at all
+        return [(doc, -score) for _, doc, score in lexical if score * fast_path_ratio >= lexical[0][2]]
+    lexical = [hit for hit in lexical if hit[2] >= lexical[0][2] * lexical_cutoff]
+    return fuse([cutoff(vector_hits(query, vdb, k, nprobe, ef_search)), lexical])
+
+
+def search(query, vdb, k=fetch_k, limit=max_results, lexical_index=None, nprobe=None, ef_search=None):
+    # Returns merged Documents, most relevant first. nprobe / ef_search tune IVF / HNSW indexes (see ann_index).
+    hits = ranked_hits(query, vdb, lexical_index, k, nprobe, ef_search)
+    spans = drop_near_duplicates(merge_hits(hits))[:limit]
+    docs = []
+    for span in spans:
+        metadata = {"source": span["source"]}
+        if span["start"] is not None:
+            metadata["start_index"] = span["start"]
+        docs.append(Document(page_content=span["text"], metadata=metadata))
+    return docs
@@ -0,0 +1,147 @@
+import os
+import re
+import threading
+import numpy as np
+from termcolor import colored
+import registry
+from knowledge_base import get_embedding
+from repo_parser import load_call_graph, load_symbol_index
+
+# Routes questions to a tool without an LLM call when the answer is clear; anything else is left to the LLM
+router_enabled = os.environ.get("LOCAL_ROUTER", "1") == "1"
+similarity_threshold = float(os.environ.get("ROUTER_SIMILARITY_THRESHOLD", 0.6))
+similarity_margin = float(os.environ.get("ROUTER_SIMILARITY_MARGIN", 0.1))
+
+# Shared with the LLM tool selection prompt in tool_planner
+tool_examples = [
+    ("How to use the function extract_function_name?", "Code_Searcher"),
+    ("How to use the function def supabase_vdb(knowledge_base):?", "Code_Searcher"),
+    ("How to create a knowledge base?", "Repo_Parser"),
+    ("How to use the knowledge base?", "Repo_Parser"),
+    ("How does this repo generate the UI interface?", "Repo_Parser"),
+    ("How to use Text Splitters in this repo?", "Repo_Parser"),
+    ("How to use the python asyncio library?", "No_Tool"),
+]
+
+# Extra examples only used by the local classifier
+classifier_examples = tool_examples + [
+    ("What is the usage of this repo?", "Repo_Parser"),
+    ("Which function launches the application in the repo?", "Repo_Parser"),
+    ("Where is the configuration loaded?", "Repo_Parser"),
+    ("How does the code manage the knowledge base?", "Repo_Parser"),
+    ("Which function is in charge of processing incoming messages?", "Repo_Parser"),
+    ("What does this project do?", "Repo_Parser"),
+    ("How is the 'asyncio' library used in Python?", "No_Tool"),
+    ("Can you explain the workings of smart pointers in C++?", "No_Tool"),
+    ("What is the difference between a list and a tuple in Python?", "No_Tool"),
+    ("How do I write a for loop in JavaScript?", "No_Tool"),
+]
+
+BACKTICK_RE = re.compile(r"`([^`]+)`|'([^'\s]+)'|\"([^\"\s]+)\"")
+# A call has no space before the parenthesis, unlike "the repo (briefly)"
+CALL_RE = re.compile(r"([A-Za-z_][\w.]*)\(")
+# snake_case, camelCase/PascalCase with an inner capital, or dotted names
+CODE_LIKE_RE = re.compile(r"\b([A-Za-z_]\w*_\w*|[a-z]+[A-Z]\w*|[A-Z][a-z0-9]+[A-Z]\w*|[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)+)\b")
+
+_stats_lock = threading.Lock()
+_stats = {"identifier": 0, "embedding": 0, "llm": 0, "errors": 0}
+
+
+def record(kind):
+    with _stats_lock:
+        _stats[kind] += 1
+
+
+def router_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    routed = stats["identifier"] + stats["embedding"]
+    total = routed + stats["llm"]
+    stats["hit_rate"] = routed / total if total else 0.0
+    return stats
+
+
+def candidate_identifiers(question, file_names=frozenset()):
+    # Ordered by how explicitly the question marks them as code; dotted names that are file names
+    # (e.g. README.md) are not identifiers, and neither is their extension
+    candidates = []
+    for match in BACKTICK_RE.finditer(question):
+        text = next(group for group in match.groups() if group)
+        call = CALL_RE.search(text)
+        candidates.append(call.group(1) if call else text.strip())
+    candidates += [match.group(1) for match in CALL_RE.finditer(question)]
+    candidates += [match.group(1) for match in CODE_LIKE_RE.finditer(question)]
+    seen, result = set(), []
+    for candidate in candidates:
+        candidate = candidate.split()[-1].strip(".:?") if candidate.split() else ""
+        if candidate in file_names:
+            continue
+        for name in [candidate, candidate.split(".")[-1]]:
+            if name and name not in seen and re.fullmatch(r"[A-Za-z_][\w.]*", name):
+                seen.add(name)
+                result.append(name)
+    return result
+
+
+def match_identifier(question, dir_path):
+    # Only names defined in the repo are routed locally; plain words that merely occur in it
+    # (e.g. "requirements") are left to the LLM
+    candidates = candidate_identifiers(question)
+    if any("." in name for name in candidates):
+        file_names = {os.path.basename(filepath) for filepath in load_symbol_index(dir_path).files}
+        candidates = candidate_identifiers(question, file_names)
+    if not candidates:
+        return None
+    call_graph = load_call_graph(dir_path)
+    for name in candidates:
+        if call_graph.find_definitions(name):
+            return name
+    return None
+
+
+def example_embeddings():
+    def embed():
+        vectors = np.asarray([get_embedding().embed_query(question) for question, _ in classifier_examples],
+                             dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    return registry.get_singleton("router:examples", embed)
+
+
+def classify(question):
+    vector = np.asarray(get_embedding().embed_query(question), dtype=np.float32)
+    vector /= np.linalg.norm(vector) or 1.0
+    similarities = example_embeddings() @ vector
+
+    best = {}
+    for (_, tool), similarity in zip(classifier_examples, similarities):
+        best[tool] = max(best.get(tool, -1.0), float(similarity))
+    ranked = sorted(best.items(), key=lambda item: -item[1])
+    tool, score = ranked[0]
+    runner_up = ranked[1][1] if len(ranked) > 1 else -1.0
+    # Code_Searcher needs a name that is in the repo, which identifier matching already ruled out
+    if tool != "Code_Searcher" and score >= similarity_threshold and score - runner_up >= similarity_margin:
+        return tool
+    return None
+
+
+def route(question, dir_path="./code_repo"):
+    # Returns (tool, function_name) when confident, None to fall back to the LLM
+    if not router_enabled:
+        return None
+    try:
+        name = match_identifier(question, dir_path)
+        if name is not None:
+            record("identifier")
+            print(colored(f"Routed locally by identifier: Code_Searcher ({name})", "green"))
+            return "Code_Searcher", name
+        tool = classify(question)
+        if tool is not None:
+            record("embedding")
+            print(colored(f"Routed locally by example similarity: {tool}", "green"))
+            return tool, None
+    except Exception as e:
+        record("errors")
+        print(colored(f"Local routing failed, falling back to the LLM: {e}", "red"))
+    record("llm")
+    return None
@@ -0,0 +1,188 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from termcolor import colored
+from repo_parser import get_vdb_path, read_vdb_header
+from router import candidate_identifiers, match_identifier
+import tool_planner
+import indexing_jobs
+import context_packer
+import metrics
+import util
+
+# Per-session chat memory: a token-bounded history with a running summary, and reusable retrievals
+history_token_budget = int(os.environ.get("HISTORY_TOKEN_BUDGET", 512))
+summary_token_budget = int(os.environ.get("HISTORY_SUMMARY_TOKENS", 256))
+session_retrieval_cache_size = int(os.environ.get("SESSION_RETRIEVAL_CACHE", 8))
+
+# Back-references of a follow-up question ("what does it return?"); "this repo" and the like are not one
+REFERENCE_RE = re.compile(r"\b(it|its|this|that|these|those|they|them|their|there|above|same|again)\b", re.I)
+REPO_PHRASE_RE = re.compile(r"\b(this|that|the)\s+(repo|repository|project|code\s*base|codebase|code)\b", re.I)
+max_followup_words = 15
+
+_executor = ThreadPoolExecutor(max_workers=4)
+
+summary_system_prompt = """You are an expert developer and programmer. """
+summary_user_prompt = """
+        Summarize the conversation below between a user and an assistant about a code repository.
+        Keep the names of the functions, variables, files and modules that were discussed, the questions asked
+        and the key points of the answers. Answer with the summary only, in at most {words} words.
+
+        {previous}Conversation:
+{turns}
+"""
+
+
+def index_version(repo_folder):
+    # Retrieval results are valid for one generation of the repo's indexes; None while they are being built
+    if indexing_jobs.active_job(repo_folder) is not None:
+        return None
+    header = read_vdb_header(get_vdb_path(repo_folder))
+    return header["generation"] if header is not None else None
+
+
+def is_followup(question):
+    question = REPO_PHRASE_RE.sub(" ", question)
+    return len(question.split()) <= max_followup_words and REFERENCE_RE.search(question) is not None
+
+
+def normalize(question):
+    return " ".join(question.lower().split())
+
+
+def truncate_tokens(text, budget, model):
+    # Keeps whole words while the text fits the budget
+    if context_packer.count_tokens(text, model) <= budget:
+        return text
+    words = text.split()
+    low, high = 0, len(words)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if context_packer.count_tokens(" ".join(words[:middle]), model) <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    return " ".join(words[:low]) + " ..."
+
+
+class SessionMemory:
+    def __init__(self, model):
+        self.model = model
+        self.summary = ""
+        # Number of chat turns folded into the summary
+        self.summarized_turns = 0
+        # (repo folder, index version, tool, searched name or question) -> entry
+        self.retrievals = OrderedDict()
+        self.last_retrieval = None
+        self.hits = 0
+        self.misses = 0
+        self._compaction = None
+        self._lock = threading.Lock()
+
+    def plan_context(self, question, repo_folder):
+        # tool_planner.plan_context, answered from this session's earlier retrievals when possible
+        version = index_version(repo_folder)
+        entry = self._lookup(question, repo_folder, version) if version is not None else None
+        if entry is not None:
+            self.hits += 1
+            print(colored(f"Reusing the contexts retrieved for: {entry['question']}", "green"))
+            return question + entry["suffix"], entry["chunks"]
+        self.misses += 1
+        tool, function_name, header, chunks = tool_planner.plan_tool_context(question, repo_folder)
+        if version is not None and tool is not None and chunks and header.startswith(question):
+            subject = function_name if tool == "Code_Searcher" else normalize(question)
+            self._store((repo_folder, version, tool, subject), question, header[len(question):], chunks)
+        return header, chunks
+
+    def _lookup(self, question, repo_folder, version):
+        # Only exact matches: the same Repo_Parser question, or a question about the very name an earlier
+        # Code_Searcher call searched. A follow-up that names no code reuses the last retrieval.
+        key = (repo_folder, version, "Repo_Parser", normalize(question))
+        if key not in self.retrievals:
+            key = None
+            if candidate_identifiers(question):
+                try:
+                    name = match_identifier(question, repo_folder)
+                except Exception:
+                    name = None
+                if name is not None:
+                    key = (repo_folder, version, "Code_Searcher", name)
+            elif is_followup(question) and self.last_retrieval is not None \
+                    and self.last_retrieval[:2] == (repo_folder, version):
+                key = self.last_retrieval
+        with self._lock:
+            entry = self.retrievals.get(key) if key is not None else None
+            if entry is None:
+                return None
+            self.retrievals.move_to_end(key)
+            self.last_retrieval = key
+            return entry
+
+    def _store(self, key, question, suffix, chunks):
+        with self._lock:
+            self.retrievals[key] = {"question": question, "suffix": suffix, "chunks": chunks}
+            self.retrievals.move_to_end(key)
+            self.last_retrieval = key
+            while len(self.retrievals) > session_retrieval_cache_size:
+                self.retrievals.popitem(last=False)
+
+    def replay(self, chatbot):
+        # The history messages to send: the summary, then the turns not folded into it
+        self.wait()
+        with self._lock:
+            if self.summarized_turns > len(chatbot):
+                # The chat was cleared
+                self.summary, self.summarized_turns = "", 0
+            messages = []
+            if self.summary:
+                messages.append({"role": "system", "content": "Summary of the earlier conversation: " + self.summary})
+            for user, assistant in chatbot[self.summarized_turns:]:
+                messages.extend([{"role": "user", "content": user}, {"role": "assistant", "content": assistant}])
+            return messages
+
+    def record_turn(self, chatbot):
+        # Called after each answer; folds the oldest turns into the summary in the background once the
+        # replayed turns exceed the budget, down to half of it so it does not run on every turn
+        with self._lock:
+            turns = list(chatbot[self.summarized_turns:])
+            tokens = [context_packer.count_tokens(user + assistant, self.model) for user, assistant in turns]
+            running = self._compaction is not None and not self._compaction.done()
+            if sum(tokens) <= history_token_budget or len(turns) < 2 or running:
+                return
+            fold = 0
+            while fold < len(turns) - 1 and sum(tokens[fold:]) > history_token_budget // 2:
+                fold += 1
+            self._compaction = _executor.submit(self._compact, turns[:fold])
+
+    def wait(self):
+        compaction = self._compaction
+        if compaction is not None:
+            compaction.result()
+
+    def _compact(self, turns):
+        try:
+            with metrics.span("history_compaction", turns=len(turns)) as span:
+                summary = self._summarize(turns)
+                span["tokens"] = context_packer.count_tokens(summary, self.model)
+            with self._lock:
+                self.summary = summary
+                self.summarized_turns += len(turns)
+            print(colored(f"Folded {len(turns)} turns into the conversation summary", "blue"))
+        except Exception as e:
+            # The turns stay in the replayed history and are folded after the next answer
+            print(colored(f"Failed to summarize the conversation: {e}", "red"))
+
+    def _summarize(self, turns):
+        text = "".join(f"        User: {user}\n        Assistant: {assistant}\n" for user, assistant in turns)
+        previous = f"Summary of the conversation before:\n        {self.summary}\n\n        " if self.summary else ""
+        # Roughly 0.75 words per token
+        prompt = summary_user_prompt.format(words=summary_token_budget * 3 // 4, previous=previous, turns=text)
+        try:
+            summary = util.get_chat_response(summary_system_prompt, prompt, temperature=0).strip()
+        except Exception as e:
+            # Without the LLM the questions alone are kept
+            print(colored(f"LLM summary unavailable, keeping the questions only: {e}", "yellow"))
+            summary = " ".join(filter(None, [self.summary] + [f"The user asked: {user}" for user, _ in turns]))
+        return truncate_tokens(summary, summary_token_budget, self.model)
@@ -0,0 +1,100 @@
+import os
+import json
+import time
+
+# Incremental server-sent events decoding for the streaming chat completions.
+# Every event is parsed exactly once, and UI updates are coalesced to a frame rate or token count.
+update_interval = 1.0 / float(os.environ.get("STREAM_UPDATE_FPS", 10))
+update_tokens = int(os.environ.get("STREAM_UPDATE_TOKENS", 20))
+
+
+class StreamError(Exception):
+    pass
+
+
+class SSEDecoder:
+    # Feed raw lines (without terminators); a blank line completes an event
+    def __init__(self):
+        self._event = None
+        self._data = []
+
+    def decode(self, line):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", errors="replace")
+        if not line:
+            return self.flush()
+        if line.startswith(":"):
+            return None
+        if line.startswith("{"):
+            # Plain JSON body, e.g. an error response that is not an event stream
+            return {"event": "message", "data": line}
+        field, _, value = line.partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+        if field == "data":
+            self._data.append(value)
+        elif field == "event":
+            self._event = value
+        elif field == "error":
+            # Some OpenAI-compatible servers report failures as "error: ..." lines
+            self._event, self._data = "error", [value]
+        return None
+
+    def flush(self):
+        if not self._data:
+            self._event = None
+            return None
+        event = {"event": self._event or "message", "data": "\n".join(self._data)}
+        self._event, self._data = None, []
+        return event
+
+
+def iter_chat_deltas(lines):
+    # Yields the content deltas of a chat completion stream until [DONE] or the end of the stream.
+    # Error frames raise StreamError.
+    decoder = SSEDecoder()
+    for line in lines:
+        event = decoder.decode(line)
+        if event is not None:
+            if event["data"].strip() == "[DONE]":
+                return
+            content = parse_chat_event(event)
+            if content:
+                yield content
+    event = decoder.flush()
+    if event is not None and event["data"].strip() != "[DONE]":
+        content = parse_chat_event(event)
+        if content:
+            yield content
+
+
+def parse_chat_event(event):
+    if event["event"] == "error":
+        raise StreamError(event["data"])
+    try:
+        payload = json.loads(event["data"])
+    except json.JSONDecodeError:
+        raise StreamError(f"Malformed event: {event['data'][:200]}")
+    if "error" in payload:
+        error = payload["error"]
+        raise StreamError(error.get("message", str(error)) if isinstance(error, dict) else str(error))
+    choices = payload.get("choices") or [{}]
+    return (choices[0].get("delta") or {}).get("content")
+
+
+def coalesce(deltas, interval=None, max_tokens=None):
+    # Yields the accumulated text as soon as the first token arrives, then at most once per `interval` seconds
+    # or `max_tokens` deltas, plus once at the end, instead of once per token
+    interval = update_interval if interval is None else interval
+    max_tokens = update_tokens if max_tokens is None else max_tokens
+    parts, pending, last, first = [], 0, time.monotonic(), True
+    for delta in deltas:
+        parts.append(delta)
+        pending += 1
+        now = time.monotonic()
+        if first and delta or pending >= max_tokens or now - last >= interval:
+            first = first and not delta
+            yield "".join(parts)
+            pending, last = 0, now
+    if pending or not parts:
+        yield "".join(parts)
@@ -0,0 +1,164 @@
+import os
+import re
+import json
+import threading
+from collections import OrderedDict
+
+# Inverted index from identifier to (file, line) postings, used by Code_Searcher instead of grep.
+# It is persisted per repo next to the VDB and updated for changed files only.
+SYMBOL_INDEX_VERSION = 2
+max_file_bytes = int(os.environ.get("SYMBOL_INDEX_MAX_FILE_BYTES", 2 * 1024 ** 2))
+cached_files = int(os.environ.get("SYMBOL_INDEX_CACHED_FILES", 2000))
+
+TOKEN_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+def read_text_lines(filepath):
+    # Returns None for binary or oversized files
+    try:
+        if os.path.getsize(filepath) > max_file_bytes:
+            return None
+        with open(filepath, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    if b"\0" in data[:8192]:
+        return None
+    return data.decode("utf-8", errors="replace").splitlines()
+
+
+def tokenize_lines(lines):
+    tokens = {}
+    for line_number, line in enumerate(lines, start=1):
+        for token in set(TOKEN_RE.findall(line)):
+            tokens.setdefault(token, []).append(line_number)
+    return tokens
+
+
+class SymbolIndex:
+    def __init__(self, files=None, root="."):
+        # files: path relative to root -> {"size", "mtime_ns", "hash", "tokens": {token: [line numbers]}}
+        self.files = files or {}
+        self.root = root
+        self.postings = {}
+        for filepath, entry in self.files.items():
+            self._add_postings(filepath, entry["tokens"])
+        self._lines = OrderedDict()
+        self._lines_lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, root="."):
+        if not os.path.isfile(path):
+            return None
+        with open(path, "r") as f:
+            data = json.load(f)
+        if data.get("version") != SYMBOL_INDEX_VERSION:
+            return None
+        return cls(data["files"], root)
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": SYMBOL_INDEX_VERSION, "files": self.files}, f)
+        os.replace(tmp_path, path)
+
+    def _add_postings(self, filepath, tokens):
+        for token, line_numbers in tokens.items():
+            self.postings.setdefault(token, {})[filepath] = line_numbers
+
+    def _remove_postings(self, filepath):
+        entry = self.files.get(filepath)
+        if entry is None:
+            return
+        for token in entry["tokens"]:
+            file_postings = self.postings.get(token)
+            if file_postings is not None:
+                file_postings.pop(filepath, None)
+                if not file_postings:
+                    del self.postings[token]
+
+    def update(self, files, changed, deleted):
+        # files/changed/deleted as returned by repo_parser.diff_repo_files
+        for filepath in list(deleted) + list(changed):
+            self._remove_postings(filepath)
+            self.files.pop(filepath, None)
+            self._lines.pop(filepath, None)
+        for filepath in changed:
+            lines = read_text_lines(os.path.join(self.root, filepath))
+            tokens = tokenize_lines(lines) if lines is not None else {}
+            self.files[filepath] = dict(files[filepath], tokens=tokens)
+            self._add_postings(filepath, tokens)
+        for filepath, entry in files.items():
+            if filepath in self.files:
+                self.files[filepath].update(size=entry["size"], mtime_ns=entry["mtime_ns"])
+
+    def get_lines(self, filepath):
+        # Small LRU of file contents, so repeated lookups don't touch the disk
+        with self._lines_lock:
+            entry = self._lines.get(filepath)
+            if entry is not None:
+                self._lines.move_to_end(filepath)
+                return entry
+        lines = read_text_lines(os.path.join(self.root, filepath)) or []
+        with self._lines_lock:
+            self._lines[filepath] = lines
+            if len(self._lines) > cached_files:
+                self._lines.popitem(last=False)
+        return lines
+
+    def lookup(self, name):
+        # Returns {filepath: [line numbers]} of lines containing `name`.
+        # Identifiers hit the postings directly; a name without exact hits falls back to identifiers
+        # containing it (like grep's substring match), and dotted names must match all their parts.
+        tokens = TOKEN_RE.findall(name)
+        if not tokens:
+            return {}
+        if len(tokens) == 1 and tokens[0] == name:
+            if name in self.postings:
+                return {filepath: list(lines) for filepath, lines in self.postings[name].items()}
+            matches = {}
+            for token, file_postings in self.postings.items():
+                if name in token:
+                    for filepath, lines in file_postings.items():
+                        matches.setdefault(filepath, set()).update(lines)
+            return {filepath: sorted(lines) for filepath, lines in matches.items()}
+
+        candidates = None
+        for token in set(tokens):
+            file_postings = self.postings.get(token, {})
+            token_lines = {(filepath, line) for filepath, lines in file_postings.items() for line in lines}
+            candidates = token_lines if candidates is None else candidates & token_lines
+            if not candidates:
+                return {}
+        matches = {}
+        for filepath, line in candidates:
+            lines = self.get_lines(filepath)
+            if line <= len(lines) and name in lines[line - 1]:
+                matches.setdefault(filepath, []).append(line)
+        return {filepath: sorted(lines) for filepath, lines in matches.items()}
+
+    def search(self, name, before_lines=5, after_lines=10):
+        # Returns one result per contiguous context window, overlapping windows are merged like grep does
+        results = []
+        for filepath, match_lines in sorted(self.lookup(name).items()):
+            lines = self.get_lines(filepath)
+            windows = []
+            for line in match_lines:
+                start, end = max(1, line - before_lines), min(len(lines), line + after_lines)
+                if windows and start <= windows[-1]["end_line"] + 1:
+                    windows[-1]["end_line"] = max(windows[-1]["end_line"], end)
+                    windows[-1]["match_lines"].append(line)
+                else:
+                    windows.append({"start_line": start, "end_line": end, "match_lines": [line]})
+            for window in windows:
+                line = window["match_lines"][0]
+                results.append({
+                    "filename": filepath,
+                    "line": line,
+                    "line_text": lines[line - 1] if line <= len(lines) else "",
+                    "start_line": window["start_line"],
+                    "end_line": window["end_line"],
+                    "match_lines": window["match_lines"],
+                    "context": "\n".join(lines[window["start_line"] - 1:window["end_line"]]),
+                })
+        return results
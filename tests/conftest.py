@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules live at the repo root, next to run.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LLM_RETRY_BACKOFF", "0")
+os.environ.setdefault("LLM_CACHE", "0")
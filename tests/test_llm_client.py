@@ -0,0 +1,68 @@
+import asyncio
+import pytest
+import llm_client
+import util
+from sse import iter_chat_deltas
+from benchmarks.fake_llm import FakeLLMServer, FakeLLMConfig, answer_for
+
+PAYLOAD = {"model": "gpt-3.5-turbo", "messages": [{"role": "user", "content": "Hello"}], "stream": True}
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    servers = []
+
+    def start(**config):
+        server = FakeLLMServer(FakeLLMConfig(first_token_delay=0, token_delay=0, completion_delay=0, **config))
+        servers.append(server.start())
+        monkeypatch.setenv("OPENAI_API_BASE", server.api_base)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def expected_answer(tokens):
+    return answer_for("Hello", FakeLLMConfig(tokens=tokens))
+
+
+def test_stream_chat_completion(fake_llm):
+    fake_llm(tokens=8)
+    assert "".join(iter_chat_deltas(llm_client.stream_chat_completion(PAYLOAD))) == expected_answer(8)
+
+
+def test_stream_chat_completion_retries_unavailable_server(fake_llm):
+    server = fake_llm(tokens=3, failures=2)
+    assert "".join(iter_chat_deltas(llm_client.stream_chat_completion(PAYLOAD))) == expected_answer(3)
+    assert server.requests == 3
+
+
+def test_completion_retries_are_not_stacked(fake_llm):
+    # Only the session's adapter retries; langchain's retries would multiply the attempts
+    server = fake_llm(failures=100)
+    with pytest.raises(Exception):
+        util.get_local_llm_response("You are a test.", "Hello")
+    assert server.requests == llm_client.max_retries + 1
+
+
+def test_completion_llm(fake_llm):
+    server = fake_llm(tokens=5, failures=1)
+    assert util.get_local_llm_response("You are a test.", "Hello").strip() == expected_answer(5)
+    assert server.requests == 2
+
+
+def test_async_stream_chat_completion(fake_llm):
+    server = fake_llm(tokens=6, failures=1)
+
+    async def run():
+        async with llm_client.AsyncLLMClient() as client:
+            answers = []
+            for _ in range(3):
+                answers.append([line async for line in client.stream_chat_completion(PAYLOAD)])
+        return client, answers
+
+    client, answers = asyncio.run(run())
+    assert ["".join(iter_chat_deltas(lines)) for lines in answers] == [expected_answer(6)] * 3
+    assert server.requests == 4
+    assert client.client.is_closed
@@ -0,0 +1,38 @@
+import os
+from repo_parser import sync_repo, repo_checkout_folder
+from benchmarks.synthetic_repo import generate_repo, git
+
+
+def commit_to_remote(work_path, message):
+    git(["add", "-A"], work_path)
+    git(["commit", "-q", "-m", message], work_path)
+    git(["push", "-q", work_path + ".git", "HEAD"], work_path)
+
+
+def test_sync_repo_returns_changed_files(tmp_path):
+    work_path = str(tmp_path / "remote" / "demo")
+    code_repo_path = str(tmp_path / "code_repo")
+    generate_repo(work_path, files=4, functions=2, bare=True)
+    remote = work_path + ".git"
+
+    repo_folder, changed = sync_repo(remote, code_repo_path)
+    assert repo_folder == repo_checkout_folder(remote, code_repo_path)
+    # A fresh clone has no previous state to diff against
+    assert changed is None
+    assert os.path.isfile(os.path.join(repo_folder, "README.md"))
+
+    assert sync_repo(remote, code_repo_path) == (repo_folder, [])
+
+    with open(os.path.join(work_path, "pkg_0", "module_1.py"), "a") as f:
+        f.write("\n\ndef added_function():\n    return 1\n")
+    with open(os.path.join(work_path, "docs", "new_guide.md"), "w") as f:
+        f.write("# New guide\n")
+    os.remove(os.path.join(work_path, "pkg_0", "module_2.py"))
+    commit_to_remote(work_path, "Change three files")
+
+    repo_folder, changed = sync_repo(remote, code_repo_path)
+    assert sorted(changed) == sorted(os.path.join(repo_folder, path) for path in
+                                     ["pkg_0/module_1.py", "docs/new_guide.md", "pkg_0/module_2.py"])
+    with open(os.path.join(repo_folder, "pkg_0", "module_1.py")) as f:
+        assert "def added_function" in f.read()
+    assert not os.path.exists(os.path.join(repo_folder, "pkg_0", "module_2.py"))
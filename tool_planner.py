@@ -1,7 +1,18 @@
-from code_searcher import get_function_context
-from repo_parser import generate_or_load_knowledge_from_repo, get_repo_context
+import os
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from code_searcher import get_function_context_chunks
+from repo_parser import load_knowledge_from_repo, load_lexical_index, get_repo_context_chunks
 from termcolor import colored
+from router import route, tool_examples, candidate_identifiers
 import util
+import metrics
+import indexing_jobs
+
+# Run retrieval for all tools concurrently with the LLM tool selection (see select_tool_speculatively)
+speculative_retrieval = os.environ.get("SPECULATIVE_RETRIEVAL", "1") == "1"
+speculative_search_limit = 3
+_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("SPECULATIVE_WORKERS", 20)))
 
 
 def tool_selection(input):
@@ -23,29 +34,13 @@ def tool_selection(input):
 
         Below are some example questions and answers:
 
-        - Question: How to use the function extract_function_name?
-        - Code_Searcher
-
-        - Question: How to use the function def supabase_vdb(knowledge_base):?
-        - Code_Searcher 
-
-        - Question: How to create a knowledge base?
-        - Repo_Parser 
-
-        - Question: How to use the knowledge base?
-        - Repo_Parser 
-
-        - Question: How does this repo generate the UI interface?
-        - Repo_Parser 
-        
-        - Question: How to use Text Splitters in this repo?
-        - Repo_Parser
-
-        - Question: How to use the python asyncio library?
-        - No_Tool
-
-        """ + f'Here is the user input: {input}'
-    return util.get_chat_response(system_prompt, user_prompt)
+""" + "".join(f"        - Question: {question}\n        - {tool}\n\n" for question, tool in tool_examples) + \
+        f'        Here is the user input: {input}'
+    # Deterministic, so repeated and (optionally) similar questions are answered from the LLM cache
+    with metrics.span("tool_selection") as span:
+        tool = util.get_chat_response(system_prompt, user_prompt, temperature=0, semantic_key=input)
+        span["tool"] = tool
+    return tool
 
 
 def extract_function_name(input):
@@ -67,31 +62,112 @@ def extract_function_name(input):
         - Answer: vdb 
 
         """ + f'Here is the user input: {input}'
-    return util.get_chat_response(system_prompt, user_prompt)
-
-
-def user_input_handler(input):
-    tool = tool_selection(input)
+    # Only exact cache hits: similar questions usually mention different names
+    with metrics.span("name_extraction"):
+        return util.get_chat_response(system_prompt, user_prompt, temperature=0)
+
+
+def retrieve_repo_context(input, dir_path="./code_repo"):
+    with metrics.span("retrieval") as span:
+        # While the repo is being indexed for the first time, search the part embedded so far
+        job = indexing_jobs.active_job(dir_path)
+        chunks = job.search_partial(lambda vdb: get_repo_context_chunks(input, vdb)) if job is not None else None
+        if chunks is None:
+            vdb = load_knowledge_from_repo(dir_path)
+            chunks = get_repo_context_chunks(input, vdb, load_lexical_index(dir_path))
+        span.update(chunks=len(chunks), chars=sum(len(chunk) for chunk in chunks))
+    return chunks
+
+
+def search_function_context(function_name, dir_path="./code_repo"):
+    with metrics.span("code_search") as span:
+        chunks = get_function_context_chunks(function_name, dir_path)
+        span.update(chunks=len(chunks), chars=sum(len(chunk) for chunk in chunks))
+    return chunks
+
+
+def submit(fn, *args):
+    # The worker runs in a copy of the caller's context, so its spans join the question's trace
+    return _executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def select_tool_speculatively(input, dir_path="./code_repo"):
+    # Retrieval is cheap compared to the LLM, so it starts for every tool while tool_selection runs.
+    # Only the result of the selected tool is used; the others are cancelled if not started yet, or discarded.
+    # The tool selection itself runs on the calling thread, so it never queues behind other questions'
+    # speculative work in the pool.
+    speculative = {("Repo_Parser", None): submit(retrieve_repo_context, input, dir_path)}
+    for name in candidate_identifiers(input)[:speculative_search_limit]:
+        speculative[("Code_Searcher", name)] = submit(search_function_context, name, dir_path)
+
+    try:
+        tool = tool_selection(input)
+    except BaseException:
+        for future in speculative.values():
+            future.cancel()
+        raise
+    for (speculative_tool, _), future in speculative.items():
+        if speculative_tool != tool:
+            future.cancel()
+    return tool, speculative
+
+
+def plan_context(input, dir_path="./code_repo"):
+    # Returns the question header and the retrieved context chunks ordered by relevance,
+    # so the caller can pack whole chunks into the model window (see context_packer).
+    # dir_path is the repo the session is bound to.
+    _, _, header, chunks = plan_tool_context(input, dir_path)
+    return header, chunks
+
+
+def plan_tool_context(input, dir_path="./code_repo"):
+    # plan_context plus the tool that was used and, for Code_Searcher, the name that was searched
+    # (None when no context was retrieved)
+    job = indexing_jobs.active_job(dir_path)
+    if job is not None and not job.queryable():
+        print(colored(f"The repo is not indexed yet ({job.status()}), answering without context", "yellow"))
+        return None, None, input, []
+    # The local router answers confident cases without the LLM round trips
+    speculative = {}
+    with metrics.span("route") as span:
+        routed = route(input, dir_path)
+        span["tool"] = routed[0] if routed is not None else None
+    if routed is not None:
+        tool, function_name = routed
+    elif speculative_retrieval:
+        (tool, speculative), function_name = select_tool_speculatively(input, dir_path), None
+    else:
+        tool, function_name = tool_selection(input), None
     print(colored(f"Tool selected: {tool}", "green"))
+
     if tool == "Code_Searcher":
         # extract the function or variable name from the input
-        function_name = extract_function_name(input)
+        if function_name is None:
+            function_name = extract_function_name(input)
         print(function_name)
         if function_name:
             # search the function with context
-            context = get_function_context(function_name)
-            prompt = input + "\n\n" + \
-                     f"Here are some the contexts of the function or variable {function_name}: \n\n" + context
-            return prompt
+            future = speculative.pop(("Code_Searcher", function_name), None)
+            chunks = future.result() if future is not None else search_function_context(function_name, dir_path)
+            header = input + "\n\n" + \
+                     f"Here are some the contexts of the function or variable {function_name}: \n\n"
+            return tool, function_name, header, chunks
     elif tool == "Repo_Parser":
-        vdb = generate_or_load_knowledge_from_repo()
-        context = get_repo_context(input, vdb)
-        prompt = input + "\n\n" + \
-                 f"Here are some contexts about the question, which are ranked by the relevance to the question: \n\n" + context
-        return prompt
+        future = speculative.pop(("Repo_Parser", None), None)
+        chunks = future.result() if future is not None else retrieve_repo_context(input, dir_path)
+        header = input + "\n\n" + \
+                 f"Here are some contexts about the question, which are ranked by the relevance to the question: \n\n"
+        return tool, None, header, chunks
     else:
         print("No tool is selected.")
-        return input
+    for future in speculative.values():
+        future.cancel()
+    return None, None, input, []
+
+
+def user_input_handler(input, dir_path="./code_repo"):
+    header, chunks = plan_context(input, dir_path)
+    return header + "".join(chunks)
 
 
 if __name__ == "__main__":
@@ -1,38 +1,52 @@
 import os
 from dotenv import load_dotenv, find_dotenv
 from termcolor import colored
-from langchain.llms import OpenAI
-from langchain.chat_models import ChatOpenAI
 from langchain.schema import HumanMessage, SystemMessage
+import llm_cache
+import llm_client
 
 load_dotenv(find_dotenv())
 
 
-def get_chat_response(system_prompt, user_prompt):
+def get_chat_response(system_prompt, user_prompt, temperature=None, semantic_key=None):
     # By default, use the local LLM
+    # semantic_key is the part of user_prompt (e.g. the question) that may be matched by similarity in the cache
     llm_type = os.environ.get('LLM_TYPE', "local")
     if llm_type == "local":
-        return get_local_llm_response(system_prompt, user_prompt)
+        model = os.environ.get('MODEL_NAME', "ggml-gpt4all-j")
+        temperature = 0.9 if temperature is None else temperature
+        llm_response = get_local_llm_response
     else:
-        return get_openai_response(system_prompt, user_prompt)
+        model = "gpt-3.5-turbo"
+        temperature = 0 if temperature is None else temperature
+        llm_response = get_openai_response
+
+    cached = llm_cache.lookup(model, temperature, system_prompt, user_prompt, semantic_key)
+    if cached is not None:
+        print(colored("LLM cache hit", "green"))
+        return cached
+    response = llm_response(system_prompt, user_prompt, model=model, temperature=temperature)
+    llm_cache.store(model, temperature, system_prompt, user_prompt, response, semantic_key)
+    return response
 
 
 def get_local_llm_response(system_prompt, user_prompt, model="ggml-gpt4all-j", temperature=0.9):
-    base_path = os.environ.get('OPENAI_API_BASE', 'http://localhost:8080/v1')
     model_name = os.environ.get('MODEL_NAME', model)
-    llm = OpenAI(temperature=temperature, openai_api_base=base_path, model_name=model_name, openai_api_key="null")
+    llm = llm_client.get_completion_llm(model_name, temperature)
     text = system_prompt + "\n\n" + user_prompt + "\n\n"
-    response = llm(text)
+    with llm_client.limit("local"):
+        response = llm(text)
     print(response)
     return response
 
 
 def get_openai_response(system_prompt, user_prompt, model="gpt-3.5-turbo", temperature=0):
-    chat = ChatOpenAI(model_name=model, temperature=temperature)
+    chat = llm_client.get_chat_llm(model, temperature)
     messages = [
         SystemMessage(content=system_prompt),
         HumanMessage(content=user_prompt)
     ]
-    response = chat(messages)
+    with llm_client.limit("openai"):
+        response = chat(messages)
     print(response)
     return response.content